@@ -27,8 +27,11 @@
         4: Message
         5: Reunion
                 e.g: type = '2' => Advertise packet.
+        The high byte of Type holds flags:
+        0x0100: Compressed; The body of this Message packet is compressed with zlib and COMPRESSION_DICTIONARY.
+        0x0200: Fragment; This Message packet carries a part of a message (see Message).
     Length:
-        This field shows the character numbers for Body of the packet.
+        This field shows the number of bytes of the Body of the packet (the character numbers for ASCII bodies).
 
     Server IP/Port:
         We need this field for response packet in non-blocking mode.
@@ -105,12 +108,18 @@
                                 ** Body Format **
                  ________________________________________________
                 |                 JOIN (4 Chars)                 |
+                |------------------------------------------------|
+                |         Capabilities (4 Chars each)            |
                 |________________________________________________|
             
             New node after getting Advertise Response from root must send this packet to the specified peer
             to tell him that they should connect together; When receiving this packet we should update our
             Client Dictionary in the Stream object.
 
+            Capabilities are optional; e.g. 'JOINZLIB' offers Message compression.
+            A parent that shares some of them answers with a Join packet whose body is 'JOIN', 'ACK' and the
+            shared capabilities, e.g. 'JOINACKZLIB'; Peers that don't know capabilities never send or get one.
+
 
             
         Message:
@@ -120,6 +129,22 @@
                 |________________________________________________|
 
             The message that want to broadcast to hole network. Right now this type only includes a plain text.
+            Between neighbours that negotiated compression on Join, a large body may be compressed (see Type);
+            Length is then the size of the compressed body.
+            The body may be any bytes (see PacketFactory.new_message_packet); Length is always its size in bytes.
+
+            Messages bigger than FRAGMENT_SIZE bytes are sent in fragments; The body of a fragment is:
+                 ________________________________________________
+                |            Message ID (4 Bytes)                |
+                |------------------------------------------------|
+                |     Offset of the fragment (4 Bytes)           |
+                |------------------------------------------------|
+                |       Size of the message (4 Bytes)            |
+                |------------------------------------------------|
+                |   Part of the UTF-8 message (#Length - 12)     |
+                |________________________________________________|
+
+            Fragments are relayed as they arrive, and every peer puts the message together on its own.
         
         Reunion:
             Hello:
@@ -174,18 +199,63 @@
 
                 Root in an answer to the Reunion Hello message will send this packet to the target node.
                 In this packet, all the nodes (IP, port) exist in order by path traversal to target.
-            
-    
+
+
+
+                                                **  Version 2  **
+
+    Version 2 is a binary encoding of the same packets; It is selected by the Version field, and a peer accepts
+    packets of both versions whatever version it sends.
+
+     __________________________________________________________________________________________________________________
+    |           Version(2 Bytes)         |         Type(2 Bytes)         |           Length(Long int/4 Bytes)          |
+    |------------------------------------------------------------------------------------------------------------------|
+    |                     Source Server IP(4 Bytes)                      |          Source Server Port(2 Bytes)        |
+    |------------------------------------------------------------------------------------------------------------------|
+    |                                                       BODY                                                       |
+    |__________________________________________________________________________________________________________________|
+
+    Length is the number of bytes of the body.
+    In the bodies of Register, Advertise and Reunion packets:
+        REQ/RES is one byte: 1 for REQ, 2 for RES.
+        An address (IP/Port) is 6 bytes: the 4 bytes of the IP and the port as an unsigned short.
+        Number of Entries of Reunion packets is an unsigned short, so paths are not limited to 99 nodes.
+    The Register Response body is RES and 'ACK'; Join and Message bodies are the same as in version 1 (UTF-8).
+
+    e.g: A Reunion Hello with 3 entries is 14 + 3 + 3 * 6 = 35 bytes; It is 20 + 5 + 3 * 20 = 85 bytes in version 1.
+
 """
-import socket
+import random
 import struct
+import zlib
 from enum import Enum, unique
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from src.tools.parsers import parse_ip, parse_port
 from src.tools.type_repo import Address
 
 VERSION = 1
+VERSION_2 = 2
+# Precompiled codec of the header: Version, Type, Length, the 4 parts of Source Server IP and Source Server Port.
+HEADER_STRUCT = struct.Struct('!HHLHHHHL')
+HEADER_SIZE = HEADER_STRUCT.size
+HEADER_STRUCT_V2 = struct.Struct('!HHLBBBBH')
+HEADER_STRUCTS = {VERSION: HEADER_STRUCT, VERSION_2: HEADER_STRUCT_V2}
+HEADER_SIZES = {version: header_struct.size for version, header_struct in HEADER_STRUCTS.items()}
+# Codecs of single header fields, for reading them from a buffer at their offset.
+PREFIX_STRUCT = struct.Struct('!HHL')  # Version, Type and Length; The same in every version.
+VERSION_STRUCT = struct.Struct('!H')  # Offset 0
+TYPE_STRUCT = struct.Struct('!H')  # Offset 2
+LENGTH_STRUCT = struct.Struct('!L')  # Offset 4
+SOURCE_STRUCT = struct.Struct('!HHHHL')  # Offset 8
+SOURCE_STRUCT_V2 = struct.Struct('!BBBBH')  # Offset 8
+# The high byte of the Type field holds flags.
+TYPE_MASK = 0x00FF
+FLAG_COMPRESSED = 0x0100
+FLAG_FRAGMENT = 0x0200
+# Codecs of version 2 bodies.
+ADDRESS_STRUCT = struct.Struct('!BBBBH')
+N_ENTRIES_STRUCT = struct.Struct('!H')  # Offset 1
 
 
 @unique
@@ -197,6 +267,60 @@ class PacketType(Enum):
     REUNION = 5
 
 
+# PacketType by value; Much faster than calling PacketType for every received packet.
+PACKET_TYPES = {packet_type.value: packet_type for packet_type in PacketType}
+# Types whose bodies are binary in version 2.
+BINARY_TYPES = (PacketType.REGISTER, PacketType.ADVERTISE, PacketType.REUNION)
+# The REQ/RES byte of version 2 bodies.
+SUB_TYPE_CODES = {'REQ': 1, 'RES': 2}
+SUB_TYPES = {code: sub_type for sub_type, code in SUB_TYPE_CODES.items()}
+
+
+# Capabilities that peers offer in the Join body.
+CAPABILITY_COMPRESSION = 'ZLIB'
+CAPABILITY_SIZE = 4
+JOIN_ACK = 'ACK'
+# Largest message part (bytes) in a Message packet; Bigger messages are fragmented.
+FRAGMENT_SIZE = 8192
+# Message ID, Offset and Size of the message at the start of a fragment body.
+FRAGMENT_STRUCT = struct.Struct('!LLL')
+# Largest packet we send (a full fragment); The servers close connections that announce a bigger one.
+MAX_FRAME_SIZE = max(HEADER_SIZES.values()) + FRAGMENT_STRUCT.size + FRAGMENT_SIZE
+# Largest message (bytes) that is put together from fragments or decompressed; Bigger ones are dropped.
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+# Message bodies smaller than this (bytes) are never compressed.
+COMPRESSION_THRESHOLD = 256
+# Preset zlib dictionary shared by every peer, so compressed messages are relayed as they are.
+COMPRESSION_DICTIONARY = (b'http://https://www. the of and to in is that for it with as was on be at by this had '
+                          b'not are but from or have an they which you were her his all she there would their we '
+                          b'him been has when who will more no if out so said what up its about into than them can '
+                          b'only other new some could time these two may then do first any my now such like our over '
+                          b'man me even most')
+
+
+def compress(data) -> bytes:
+    compressor = zlib.compressobj(zdict=COMPRESSION_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data) -> bytes:
+    """
+    :raise ValueError: If data is not valid, or it would decompress to more than FRAGMENT_SIZE bytes; No Message body
+                       that is compressed is bigger (see compress_message), and a few bytes that expand to megabytes
+                       are stopped there.
+    """
+    decompressor = zlib.decompressobj(zdict=COMPRESSION_DICTIONARY)
+    try:
+        body = decompressor.decompress(data, FRAGMENT_SIZE + 1)
+        if not decompressor.unconsumed_tail and len(body) <= FRAGMENT_SIZE:
+            body += decompressor.flush()
+        if decompressor.unconsumed_tail or len(body) > FRAGMENT_SIZE:
+            raise ValueError(f'Compressed body is bigger than {FRAGMENT_SIZE} bytes.')
+        return body
+    except zlib.error as e:
+        raise ValueError(f'Invalid compressed body: {e}') from e
+
+
 class RegisterType(Enum):
     REQ = 'REQ'
     RES = 'RES'
@@ -212,18 +336,52 @@ class AdvertiseType(Enum):
     RES = 'RES'
 
 
+def encode_address(address: Address) -> bytes:
+    """
+    :param address: IP/Port address in any format.
+
+    :return: The 6 bytes of the address in version 2 bodies.
+    :rtype: bytes
+    """
+    ip, port = address
+    return ADDRESS_STRUCT.pack(*(int(part) for part in ip.split('.')), int(port))
+
+
+def decode_address(buffer, offset: int = 0) -> Address:
+    """
+    :return: The version 2 address at 'offset' of buffer; The format is like ('192.168.001.001', 5335).
+    :rtype: Address
+    """
+    ip0, ip1, ip2, ip3, port = ADDRESS_STRUCT.unpack_from(buffer, offset)
+    return f'{ip0:03}.{ip1:03}.{ip2:03}.{ip3:03}', port
+
+
 class Packet:
+    __slots__ = ('version', 'packet_type', 'length', 'source_ip', 'source_port', 'flags', '_body', '_buf', '_path')
+
     def __init__(self, version: int, packet_type: PacketType, length: int, source_ip: str, source_port: int,
-                 body: str):
+                 body: Union[str, bytes, None], buf=None, flags: int = 0):
         """
         The decoded buffer should convert to a new packet.
+
+        The network format is packed once and shared by every send.
+        A Reunion packet can be edited in place by the hop that forwards it (append_address, pop_address and
+        set_source_server_address); Don't edit a packet that is already in an out buffer.
+
+        :param body: The body; Already encoded if it is bytes, None to take it from buf when it is first asked for.
+        :param buf: The packet in the network format (any bytes-like object), if we have it already.
+        :param flags: The flags of the Type field; e.g. FLAG_COMPRESSED.
         """
         self.version = version
         self.packet_type = packet_type
         self.length = length
         self.source_ip = source_ip
         self.source_port = source_port
-        self.body = body
+        self.flags = flags
+        self._body = body
+        self._buf = buf
+        # The Reunion path, once it is parsed.
+        self._path: Optional[List[Address]] = None
 
     def get_header(self) -> str:
         """
@@ -257,26 +415,127 @@ class Packet:
         """
         return self.length
 
+    def is_binary(self) -> bool:
+        """
+
+        :return: Whether the body is in the binary format of version 2.
+        :rtype: bool
+        """
+        return self.version == VERSION_2 and self.packet_type in BINARY_TYPES
+
+    def is_compressed(self) -> bool:
+        """
+
+        :return: Whether the body is compressed.
+        :rtype: bool
+        """
+        return bool(self.flags & FLAG_COMPRESSED)
+
+    def is_fragment(self) -> bool:
+        """
+
+        :return: Whether this Message packet is a fragment of a message.
+        :rtype: bool
+        """
+        return bool(self.flags & FLAG_FRAGMENT)
+
+    def get_fragment(self):
+        """
+
+        :return: Message ID, offset, size of the message and the part of the message (a memoryview) of a fragment.
+        :rtype: tuple
+        """
+        body = memoryview(self.get_raw_body())
+        message_id, offset, total = FRAGMENT_STRUCT.unpack_from(body)
+        return message_id, offset, total, body[FRAGMENT_STRUCT.size:]
+
+    def get_raw_body(self):
+        """
+
+        :return: The body in the network format, without decoding it; A bytes-like object.
+        """
+        if self._buf is not None:
+            return memoryview(self._buf)[HEADER_SIZES[self.version]:]
+        if type(self._body) == bytes:
+            return self._body
+        return self._body.encode('utf-8')
+
     def get_body(self) -> str:
         """
+        Binary bodies of version 2 are returned in their version 1 text format, and compressed bodies decompressed.
 
         :return: Packet body
         :rtype: str
         """
-        return self.body
+        if type(self._body) == str:
+            return self._body
+        if self.is_compressed():
+            body = str(decompress(self.get_raw_body()), 'utf-8')
+        elif self.is_binary():
+            body = self.__render_body()
+        else:
+            body = str(self.get_raw_body(), 'utf-8')
+        if self._body is None:
+            # Otherwise _body holds the encoded body, since we have no buf to take it from.
+            self._body = body
+        return body
+
+    def __render_body(self) -> str:
+        body = self.get_sub_type()
+        if self.packet_type == PacketType.REUNION:
+            body += str(self.get_n_entries()).zfill(2)
+            addresses = self.get_addresses()
+        elif self.packet_type == PacketType.ADVERTISE and body == 'RES':
+            addresses = [self.get_advertised_address()]
+        elif self.packet_type == PacketType.REGISTER and body == 'REQ':
+            addresses = [decode_address(self.get_raw_body(), 1)]
+        else:
+            addresses = []
+            body += str(self.get_raw_body()[1:], 'utf-8')
+        return body + ''.join(parse_ip(ip) + parse_port(port) for ip, port in addresses)
+
+    def get_body_bytes(self) -> bytes:
+        """
+        The body of a Message packet as the application sent it, without decoding it as text.
+
+        :return: Packet body; Decompressed if it was compressed, and the raw fragment body for fragments.
+        :rtype: bytes
+
+        :raise ValueError: If the body cannot be decompressed (see decompress).
+        """
+        if self.is_compressed():
+            return decompress(self.get_raw_body())
+        return bytes(self.get_raw_body())
+
+    def get_body_size(self) -> int:
+        """
+
+        :return: Size of the body in the network format (bytes), without decoding it.
+        :rtype: int
+        """
+        if self._buf is not None:
+            return len(self._buf) - HEADER_SIZES[self.version]
+        return len(self.get_raw_body())
 
     def get_buf(self) -> bytes:
         """
         In this function, we will make our final buffer that represents the Packet with the Struct class methods.
 
+        It is made on the first call only; Later calls return the same object.
+
         :return The parsed packet to the network format.
-        :rtype: bytearray
+        :rtype: bytes
         """
-        ip = [int(part) for part in self.source_ip.split('.')]
-        return bytes(
-            struct.pack(f'!HHLHHHHL{len(self.body)}s', self.version, self.packet_type.value, self.length, ip[0], ip[1],
-                        ip[2],
-                        ip[3], self.source_port, bytes(self.body, 'utf-8')))
+        if type(self._buf) != bytes:
+            if self._buf is not None:
+                # A received packet; Its frame is all we need.
+                self._buf = bytes(self._buf)
+            else:
+                ip = [int(part) for part in self.source_ip.split('.')]
+                type_field = self.packet_type.value | self.flags
+                self._buf = HEADER_STRUCTS[self.version].pack(self.version, type_field, self.length, *ip,
+                                                              self.source_port) + self.get_raw_body()
+        return self._buf
 
     def get_source_server_ip(self) -> str:
         """
@@ -302,42 +561,183 @@ class Packet:
         """
         return parse_ip(self.source_ip), self.source_port
 
+    def get_sub_type(self) -> Optional[str]:
+        """
+
+        :return: 'REQ' or 'RES' for Register, Advertise and Reunion packets; None for the others.
+        :rtype: str
+        """
+        if self.packet_type not in BINARY_TYPES:
+            return None
+        if self.is_binary():
+            return SUB_TYPES.get(self.get_raw_body()[0])
+        return self.get_body()[:3]
+
     def get_addresses(self) -> Optional[List[Address]]:
         if self.get_type() != PacketType.REUNION:
             return None
-        body = self.get_body()
-        n_entries = self.get_n_entries()
-        addresses = []
-        for i in range(n_entries):
-            ip_start = 5 + 20 * i
-            ip_end = ip_start + 15
-            port_start = 20 + 20 * i
-            port_end = port_start + 5
-            addresses.append((body[ip_start:ip_end], int(body[port_start:port_end])))
-        return addresses
+        if self._path is None:
+            body = self.get_raw_body()
+            self._path = [self.__decode_entry(body, i) for i in range(self.get_n_entries())]
+        return list(self._path)
 
     def get_addresses_in_reverse(self) -> Optional[List[Address]]:
-        if self.get_type() != PacketType.REUNION:
+        addresses = self.get_addresses()
+        if addresses is None:
             return None
-        body = self.get_body()
-        n_entries = self.get_n_entries()
-        addresses = []
-        for i in range(n_entries - 1, -1, -1):
-            ip_start = 5 + 20 * i
-            ip_end = ip_start + 15
-            port_start = 20 + 20 * i
-            port_end = port_start + 5
-            addresses.append((body[ip_start:ip_end], int(body[port_start:port_end])))
+        addresses.reverse()
         return addresses
 
     def get_n_entries(self) -> Optional[int]:
         if self.get_type() != PacketType.REUNION:
             return None
-        return int(self.get_body()[3:5])
+        if self._path is not None:
+            return len(self._path)
+        if self.is_binary():
+            return N_ENTRIES_STRUCT.unpack_from(self.get_raw_body(), 1)[0]
+        return int(bytes(self.get_raw_body()[3:5]))
+
+    def get_address(self, index: int) -> Address:
+        """
+        A single entry of a Reunion path, without parsing the others.
+
+        :param index: Index of the entry; Negative indexes count from the end.
+
+        :return: The address; The format is like ('192.168.001.001', 5335).
+        :rtype: Address
+        """
+        if self._path is not None:
+            return self._path[index]
+        n_entries = self.get_n_entries()
+        if index < 0:
+            index += n_entries
+        if not 0 <= index < n_entries:
+            raise IndexError('Reunion path index out of range.')
+        return self.__decode_entry(self.get_raw_body(), index)
+
+    def append_address(self, address: Address) -> None:
+        """
+        Add an address at the end of the Reunion path; Only the new entry is encoded.
+
+        :param address: IP/Port address in any format.
+        """
+        entry = self.__encode_entry(address)
+        n_entries = self.get_n_entries()
+        buf = self.__edit()
+        self.__set_n_entries(buf, n_entries + 1)
+        buf.extend(entry)
+        self.__set_length(buf, self.length + len(entry))
+        if self._path is not None:
+            self._path.append((parse_ip(address[0]), int(address[1])))
+
+    def pop_address(self, index: int = 0) -> Address:
+        """
+        Remove an address from the Reunion path.
+
+        :param index: Index of the entry; Negative indexes count from the end.
+
+        :return: The removed address.
+        :rtype: Address
+        """
+        address = self.get_address(index)
+        n_entries = self.get_n_entries()
+        if index < 0:
+            index += n_entries
+        first_entry, entry_size = self.__entry_layout()
+        start = HEADER_SIZES[self.version] + first_entry + entry_size * index
+        buf = self.__edit()
+        del buf[start:start + entry_size]
+        self.__set_n_entries(buf, n_entries - 1)
+        self.__set_length(buf, self.length - entry_size)
+        if self._path is not None:
+            del self._path[index]
+        return address
+
+    def set_source_server_address(self, address: Address) -> None:
+        """
+        Rewrite the Source Server IP/Port fields; Used by the hop that forwards the packet.
+        Nothing else of the packet is decoded or copied for it.
+
+        :param address: IP/Port address in any format.
+        """
+        ip, port = address
+        buf = self._buf
+        if type(buf) != memoryview or buf.readonly:
+            buf = self.__edit()
+        # Otherwise it is the received frame, and we can write into it; The body stays where it is.
+        source_struct = SOURCE_STRUCT_V2 if self.version == VERSION_2 else SOURCE_STRUCT
+        source_struct.pack_into(buf, 8, *(int(part) for part in ip.split('.')), port)
+        self.source_ip = ip
+        self.source_port = port
+
+    def __edit(self) -> bytearray:
+        """
+        :return: The network format in a bytearray that the edit methods change in place.
+        """
+        if type(self._buf) != bytearray:
+            self._buf = bytearray(self.get_buf())
+        # The body is taken from the buffer from now on.
+        self._body = None
+        return self._buf
+
+    def __set_length(self, buf: bytearray, length: int) -> None:
+        LENGTH_STRUCT.pack_into(buf, 4, length)
+        self.length = length
+
+    def __set_n_entries(self, buf: bytearray, n_entries: int) -> None:
+        offset = HEADER_SIZES[self.version]
+        if self.is_binary():
+            N_ENTRIES_STRUCT.pack_into(buf, offset + 1, n_entries)
+        elif n_entries > 99:
+            raise ValueError('A version 1 Reunion packet has at most 99 entries.')
+        else:
+            buf[offset + 3:offset + 5] = b'%02d' % n_entries
+
+    def __entry_layout(self):
+        """
+        :return: Offset of the first Reunion entry in the body and the size of an entry.
+        """
+        return (3, 6) if self.is_binary() else (5, 20)
+
+    def __decode_entry(self, body, index: int) -> Address:
+        first_entry, entry_size = self.__entry_layout()
+        start = first_entry + entry_size * index
+        if self.is_binary():
+            return decode_address(body, start)
+        entry = str(body[start:start + entry_size], 'ascii')
+        return entry[:15], int(entry[15:])
+
+    def __encode_entry(self, address: Address) -> bytes:
+        if self.is_binary():
+            return encode_address(address)
+        return (parse_ip(address[0]) + parse_port(address[1])).encode('ascii')
+
+    def get_capabilities(self) -> Optional[List[str]]:
+        """
+
+        :return: Capabilities in the body of a Join packet (without 'ACK'); None for other packets.
+        :rtype: list
+        """
+        if self.get_type() != PacketType.JOIN:
+            return None
+        capabilities = self.get_body()[4:]
+        if self.is_join_ack():
+            capabilities = capabilities[len(JOIN_ACK):]
+        return [capabilities[i:i + CAPABILITY_SIZE] for i in range(0, len(capabilities), CAPABILITY_SIZE)]
+
+    def is_join_ack(self) -> bool:
+        """
+
+        :return: Whether this is the answer of a parent to the capabilities of a Join packet.
+        :rtype: bool
+        """
+        return self.get_type() == PacketType.JOIN and self.get_body()[4:4 + len(JOIN_ACK)] == JOIN_ACK
 
     def get_advertised_address(self) -> Optional[Address]:
         if self.get_type() != PacketType.ADVERTISE:
             return None
+        if self.is_binary():
+            return decode_address(self.get_raw_body(), 1)
         body = self.get_body()
         return body[3:18], int(body[18:23])
 
@@ -352,110 +752,274 @@ class PacketFactory:
         """
         In this function we will make a new Packet from input buffer with struct class methods.
 
-        :param buffer: The buffer that should be parse to a validate packet format
+        Only the header is decoded here; The body is decoded from the buffer when a handler asks for it.
+        Packets of every version in HEADER_STRUCTS are accepted.
+
+        :param buffer: The buffer that should be parse to a validate packet format; Any bytes-like object.
 
         :return new packet
         :rtype: Packet
 
         """
-        header = buffer[:20]
-        body = buffer[20:]
-        version, packet_type, length = struct.unpack('!HHI', header[:8])
-        # Choose odd bytes of the 8 bytes of ip because ip is 4 bytes
-        source_ip = socket.inet_ntoa(header[8:16][1::2])
-        source_port = struct.unpack('!I', header[16:20])[0]
-        body_chars = struct.unpack(f'{len(body)}s', body)[0].decode('utf-8')
-        return Packet(version, PacketType(packet_type), length, source_ip, source_port, body_chars)
+        view = memoryview(buffer)
+        version = VERSION_STRUCT.unpack_from(view)[0]
+        if version not in HEADER_STRUCTS:
+            raise ValueError(f'Unknown packet version {version}.')
+        version, type_field, length, ip0, ip1, ip2, ip3, source_port = HEADER_STRUCTS[version].unpack_from(view)
+        source_ip = f'{ip0}.{ip1}.{ip2}.{ip3}'
+        packet_type = type_field & TYPE_MASK
+        return Packet(version, PACKET_TYPES.get(packet_type) or PacketType(packet_type), length, source_ip, source_port,
+                      None, view, type_field & ~TYPE_MASK)
+
+    @staticmethod
+    def parse_buffers(buffers: List) -> List[Packet]:
+        """
+        Parse a batch of received packets; Malformed ones (unknown version or type, or a Length that doesn't match the
+        size of the body) are dropped.
+
+        :param buffers: Received packets; Any bytes-like objects.
+
+        :return: The valid packets, in the order of buffers.
+        :rtype: list
+        """
+        packets = []
+        for buffer in buffers:
+            try:
+                packet = PacketFactory.parse_buffer(buffer)
+            except (ValueError, struct.error):
+                continue
+            if packet.get_length() == packet.get_body_size():
+                packets.append(packet)
+        return packets
 
     @staticmethod
-    def new_reunion_packet(reunion_type: ReunionType, source_address: Address, addresses: List[Address]) -> Packet:
+    def get_frame_size(buffer: memoryview) -> Optional[int]:
+        """
+        Measures the packet at the start of a byte stream by its Length field; Used for reassembling packets.
+
+        :param buffer: Received bytes that have not been parsed yet.
+
+        :return: Size of the whole packet (header and body) or None if the Length field has not arrived yet.
+        :rtype: int
+        """
+        if len(buffer) < 8:
+            return None
+        version, _, length = PREFIX_STRUCT.unpack_from(buffer)
+        return HEADER_SIZES.get(version, HEADER_SIZE) + length
+
+    @staticmethod
+    def get_frame_type(buffer: memoryview) -> Optional[PacketType]:
+        """
+        Reads the Type field of a received packet without parsing the rest of it.
+
+        :param buffer: A whole packet.
+
+        :return: Type of the packet or None if it is not a valid type.
+        :rtype: PacketType
+        """
+        return PACKET_TYPES.get(TYPE_STRUCT.unpack_from(buffer, 2)[0] & TYPE_MASK)
+
+    @staticmethod
+    def get_frame_source(buffer: memoryview) -> Address:
+        """
+        Reads the Source Server IP/Port fields of a received packet without parsing the rest of it.
+
+        :param buffer: A whole packet.
+
+        :return: Source server address in the same format as Packet.get_source_server_address.
+        :rtype: Address
+        """
+        source_struct = SOURCE_STRUCT_V2 if VERSION_STRUCT.unpack_from(buffer)[0] == VERSION_2 else SOURCE_STRUCT
+        *ip, port = source_struct.unpack_from(buffer, 8)
+        return '.'.join('%03d' % part for part in ip), port
+
+    @staticmethod
+    def new_reunion_packet(reunion_type: ReunionType, source_address: Address, addresses: List[Address],
+                           version: int = VERSION) -> Packet:
         """
         :param reunion_type: Reunion Hello (REQ) or Reunion Hello Back (RES)
         :param source_address: IP/Port address of the packet sender.
         :param addresses: [(ip0, port0), (ip1, port1), ...] It is the path to the 'destination'.
+        :param version: Version of the packet format.
 
         :type reunion_type: str
         :type source_address: Address
         :type addresses: List[Address]
+        :type version: int
 
         :return New reunion packet.
         :rtype Packet
         """
         n_entries = len(addresses)
-        body = reunion_type.value + str(n_entries).zfill(2)
-        for address in addresses:
-            ip, port = address
-            body += (parse_ip(ip) + parse_port(port))
+        if version == VERSION_2:
+            body = bytes([SUB_TYPE_CODES[reunion_type.value]]) + N_ENTRIES_STRUCT.pack(n_entries) + \
+                   b''.join(encode_address(address) for address in addresses)
+        else:
+            body = reunion_type.value + str(n_entries).zfill(2)
+            for address in addresses:
+                ip, port = address
+                body += (parse_ip(ip) + parse_port(port))
         length = len(body)
         source_ip, source_port = source_address
-        return Packet(VERSION, PacketType.REUNION, length, source_ip, source_port, body)
+        return Packet(version, PacketType.REUNION, length, source_ip, source_port, body)
 
     @staticmethod
     def new_advertise_packet(advertise_type: AdvertiseType, source_server_address: Address,
-                             neighbour: Address = None) -> Packet:
+                             neighbour: Address = None, version: int = VERSION) -> Packet:
         """
         :param advertise_type: Type of Advertise packet
         :param source_server_address Server address of the packet sender.
         :param neighbour: The neighbour for advertise response packet; The format is like ('192.168.001.001', 5335).
+        :param version: Version of the packet format.
 
         :type advertise_type: AdvertiseType
         :type source_server_address: Address
         :type neighbour: Address
+        :type version: int
 
         :return New advertise packet.
         :rtype Packet
 
         """
-        body = 'REQ' if advertise_type == AdvertiseType.REQ else \
-            'RES' + parse_ip(neighbour[0]) + parse_port(neighbour[1])
+        if version == VERSION_2:
+            body = bytes([SUB_TYPE_CODES[advertise_type.value]])
+            if advertise_type == AdvertiseType.RES:
+                body += encode_address(neighbour)
+        else:
+            body = 'REQ' if advertise_type == AdvertiseType.REQ else \
+                'RES' + parse_ip(neighbour[0]) + parse_port(neighbour[1])
         length = len(body)
-        return Packet(VERSION, PacketType.ADVERTISE, length, source_server_address[0], source_server_address[1], body)
+        return Packet(version, PacketType.ADVERTISE, length, source_server_address[0], source_server_address[1], body)
 
     @staticmethod
-    def new_join_packet(source_server_address: Address) -> Packet:
+    def new_join_packet(source_server_address: Address, version: int = VERSION, capabilities: List[str] = (),
+                        ack: bool = False) -> Packet:
         """
         :param source_server_address: Server address of the packet sender.
+        :param version: Version of the packet format.
+        :param capabilities: Capabilities we offer, or the ones we share in an answer.
+        :param ack: Whether it is the answer of a parent to the capabilities of a Join packet.
 
         :type source_server_address: Address
+        :type version: int
+        :type capabilities: List[str]
+        :type ack: bool
 
         :return New join packet.
         :rtype Packet
 
         """
-        body, length = 'JOIN', 4
-        return Packet(VERSION, PacketType.JOIN, length, source_server_address[0], source_server_address[1], body)
+        body = 'JOIN' + (JOIN_ACK if ack else '') + ''.join(capabilities)
+        length = len(body)
+        return Packet(version, PacketType.JOIN, length, source_server_address[0], source_server_address[1], body)
 
     @staticmethod
-    def new_register_packet(register_type: RegisterType, source_server_address: Address) -> Packet:
+    def new_register_packet(register_type: RegisterType, source_server_address: Address,
+                            version: int = VERSION) -> Packet:
         """
         :param register_type: Type of Register packet
         :param source_server_address: Server address of the packet sender.
+        :param version: Version of the packet format.
 
         :type register_type: RegisterType
         :type source_server_address: Address
+        :type version: int
 
         :return New Register packet.
         :rtype Packet
 
         """
-        body = 'REQ' + parse_ip(source_server_address[0]) + parse_port(source_server_address[1]) \
-            if register_type == RegisterType.REQ else 'RES' + 'ACK'
+        if version == VERSION_2:
+            body = bytes([SUB_TYPE_CODES[register_type.value]])
+            body += encode_address(source_server_address) if register_type == RegisterType.REQ else b'ACK'
+        else:
+            body = 'REQ' + parse_ip(source_server_address[0]) + parse_port(source_server_address[1]) \
+                if register_type == RegisterType.REQ else 'RES' + 'ACK'
         length = len(body)
-        return Packet(VERSION, PacketType.REGISTER, length, source_server_address[0], source_server_address[1], body)
+        return Packet(version, PacketType.REGISTER, length, source_server_address[0], source_server_address[1], body)
 
     @staticmethod
-    def new_message_packet(message: str, source_server_address: Address) -> Packet:
+    def new_message_packet(message: Union[str, bytes, memoryview], source_server_address: Address,
+                           version: int = VERSION) -> Packet:
         """
         Packet for sending a broadcast message to the whole network.
 
-        :param message: Our message
+        :param message: Our message; Text is sent in UTF-8, and bytes-like objects as they are.
         :param source_server_address: Server address of the packet sender.
+        :param version: Version of the packet format.
 
-        :type message: str
+        :type message: str, bytes or memoryview
         :type source_server_address: Address
+        :type version: int
 
         :return: New Message packet.
         :rtype: Packet
+
+        :raise ValueError: If the message is bigger than FRAGMENT_SIZE bytes; Receivers refuse such frames, so send it
+                           with new_message_packets.
+        """
+        body = message.encode('utf-8') if type(message) == str else bytes(message)
+        if len(body) > FRAGMENT_SIZE:
+            raise ValueError(f'Message of {len(body)} bytes is bigger than {FRAGMENT_SIZE}; Fragment it.')
+        return Packet(version, PacketType.MESSAGE, len(body), source_server_address[0], source_server_address[1],
+                      body)
+
+    @staticmethod
+    def new_message_packets(message: Union[str, bytes, memoryview], source_server_address: Address,
+                            version: int = VERSION, fragment_size: int = FRAGMENT_SIZE) -> List[Packet]:
+        """
+        Packets for broadcasting a message of any size; One Message packet, or fragments if it is too big.
+
+        :param message: Our message; Text or a bytes-like object, like in new_message_packet.
+        :param source_server_address: Server address of the packet sender.
+        :param version: Version of the packet format.
+        :param fragment_size: Largest part of the message in one packet (bytes); At most FRAGMENT_SIZE.
+
+        :return: The packets, in order.
+        :rtype: List[Packet]
+        """
+        if not 0 < fragment_size <= FRAGMENT_SIZE:
+            raise ValueError(f'Fragment size must be between 1 and {FRAGMENT_SIZE}.')
+        data = memoryview(message.encode('utf-8') if type(message) == str else message).cast('B')
+        if len(data) <= fragment_size:
+            return [PacketFactory.new_message_packet(data, source_server_address, version)]
+        message_id = random.getrandbits(32)
+        packets = []
+        for offset in range(0, len(data), fragment_size):
+            body = FRAGMENT_STRUCT.pack(message_id, offset, len(data)) + data[offset:offset + fragment_size]
+            packets.append(Packet(version, PacketType.MESSAGE, len(body), source_server_address[0],
+                                  source_server_address[1], body, flags=FLAG_FRAGMENT))
+        return packets
+
+    @staticmethod
+    def compress_message(packet: Packet) -> Packet:
+        """
+        Compress the body of a Message packet.
+
+        :param packet: A Message packet that is not compressed.
+
+        :return: A compressed copy of packet, or packet itself if its body is below COMPRESSION_THRESHOLD or
+                 doesn't get smaller; Fragments are not compressed either.
+        :rtype: Packet
+        """
+        body = packet.get_raw_body()
+        if len(body) < COMPRESSION_THRESHOLD or packet.is_fragment():
+            return packet
+        compressed = compress(body)
+        if len(compressed) >= len(body):
+            return packet
+        return Packet(packet.version, PacketType.MESSAGE, len(compressed), packet.source_ip, packet.source_port,
+                      compressed, flags=packet.flags | FLAG_COMPRESSED)
+
+    @staticmethod
+    def decompress_message(packet: Packet) -> Packet:
+        """
+        :param packet: A Message packet.
+
+        :return: A copy of packet with the body not compressed, or packet itself if it is not compressed.
+        :rtype: Packet
         """
-        length = len(message)
-        return Packet(VERSION, PacketType.MESSAGE, length, source_server_address[0], source_server_address[1], message)
+        if not packet.is_compressed():
+            return packet
+        return PacketFactory.new_message_packet(packet.get_body_bytes(), (packet.source_ip, packet.source_port),
+                                                packet.version)
@@ -3,13 +3,16 @@ import sys
 import threading
 import time
 from enum import Enum
-from typing import Callable, List
+from typing import Callable, List, Set, Union
 
-from src.Packet import AdvertiseType, Packet, PacketFactory, PacketType, RegisterType, ReunionType
+from src.Packet import CAPABILITY_COMPRESSION, MAX_MESSAGE_SIZE, VERSION, AdvertiseType, Packet, PacketFactory, \
+    PacketType, RegisterType, ReunionType
 from src.Stream import Stream
 from src.UserInterface import UserInterface
 from src.tools.Graph import GraphNode, NetworkGraph
+from src.tools.Reassembler import Reassembler
 from src.tools.SemiNode import SemiNode
+from src.tools.TopologyExporter import TopologyExporter
 from src.tools.parsers import parse_ip
 from src.tools.type_repo import Address
 from tools.logger import log
@@ -22,6 +25,15 @@ from tools.logger import log
 
 MAX_PENDING_TIME = 36
 MAX_HELLO_INTERVAL = 24
+# In event driven mode, the main loop wakes up at least this often (seconds) even if nothing happened.
+MAX_IDLE_TIME = 2
+# A fragmented message that got no fragment for this many seconds is dropped.
+REASSEMBLY_TIMEOUT = 60
+# Bytes and number of fragmented messages that are kept while they are incomplete, of all senders together.
+REASSEMBLY_MAX_BUFFERED = 2 * MAX_MESSAGE_SIZE
+REASSEMBLY_MAX_MESSAGES = 256
+# Minimum seconds between two topology snapshots of the root.
+TOPOLOGY_EXPORT_INTERVAL = 5
 
 
 class ReunionMode(Enum):
@@ -31,7 +43,9 @@ class ReunionMode(Enum):
 
 class Peer:
     def __init__(self, server_ip: str, server_port: int, is_root: bool = False, root_address: Address = None,
-                 command_line=True) -> None:
+                 command_line=True, event_driven: bool = False, version: int = VERSION, compression: bool = False,
+                 on_message: Callable[[bytes], None] = None, topology_export: str = None,
+                 **stream_options) -> None:
         """
         The Peer object constructor.
 
@@ -52,11 +66,25 @@ class Peer:
         :param server_port: Server Port address for this Peer that should be pass to Stream.
         :param is_root: Specify that is this Peer root or not.
         :param root_address: Root IP/Port address if we are a client.
+        :param event_driven: Wake the main loop up as soon as something happens instead of sleeping 2 seconds.
+        :param version: Packet format version of the packets we make; Packets of every version are accepted.
+        :param compression: Offer Message compression on Join; Large messages are compressed on the links to
+                            neighbours that accept it too.
+        :param on_message: Called with the body (bytes) of every broadcast message we receive.
+        :param topology_export: Only for the root; A file to keep a snapshot of the network topology in (DOT if it
+                                ends with '.dot', otherwise JSON); It is written by a background thread, at most every
+                                TOPOLOGY_EXPORT_INTERVAL seconds.
+        :param stream_options: Extra keyword arguments for our Stream; e.g. transport=TransportMode.ASYNCIO.
 
         :type server_ip: str
         :type server_port: int
         :type is_root: bool
         :type root_address: Address
+        :type event_driven: bool
+        :type version: int
+        :type compression: bool
+        :type on_message: Callable
+        :type topology_export: str
         """
         self.server_ip = parse_ip(server_ip)
         self.server_port = server_port
@@ -69,14 +97,27 @@ class Peer:
         self.registered: List[SemiNode] = []
         self.parent_address: Address = None
         self.children_addresses: List[Address] = []
-        self.stream = Stream(server_ip, server_port)
-        self.user_interface = UserInterface()
+        self.event_driven = event_driven
+        self.version = version
+        self.compression = compression
+        # Neighbours that negotiated Message compression with us.
+        self.compression_neighbours: Set[Address] = set()
+        self.reassembler = Reassembler(MAX_MESSAGE_SIZE, REASSEMBLY_TIMEOUT, REASSEMBLY_MAX_BUFFERED,
+                                       REASSEMBLY_MAX_MESSAGES)
+        self.on_message = on_message
+        self.stream = Stream(server_ip, server_port, **stream_options)
+        self.user_interface = UserInterface(self.stream.activity)
 
         self.last_hello_back_time = None  # When you received your last hello back from root
         self.last_hello_time = None  # When you sent your last hello to root
 
         if is_root:
             self.network_graph = NetworkGraph(GraphNode((self.server_ip, self.server_port)))
+            if topology_export:
+                self.topology_exporter = TopologyExporter(self.network_graph.snapshot, topology_export,
+                                                          min_interval=TOPOLOGY_EXPORT_INTERVAL)
+                self.network_graph.on_change = self.topology_exporter.notify
+                self.topology_exporter.start()
             self.reunion_daemon.start()
         elif command_line:
             self.start_user_interface()
@@ -121,19 +162,26 @@ class Peer:
 
     def __register(self) -> None:
         if self.stream.add_node(self.root_address, set_register_connection=True):
-            register_packet = PacketFactory.new_register_packet(RegisterType.REQ, self.address)
+            register_packet = PacketFactory.new_register_packet(RegisterType.REQ, self.address, self.version)
             self.stream.add_message_to_out_buff(self.root_address, register_packet, want_register=True)
             log(f'Register packet added to out buff of Node({self.root_address}).')
 
     def handle_advertise_command(self) -> None:
-        advertise_packet = PacketFactory.new_advertise_packet(AdvertiseType.REQ, self.address)
+        advertise_packet = PacketFactory.new_advertise_packet(AdvertiseType.REQ, self.address, version=self.version)
         self.stream.add_message_to_out_buff(self.root_address, advertise_packet, want_register=True)
         log(f'Advertise packet added to out buff of Node({self.root_address}).')
 
     def handle_message_command(self, command: str) -> None:
-        message = command[12:]
-        broadcast_packet = PacketFactory.new_message_packet(message, self.address)
-        self.send_broadcast_packet(broadcast_packet)
+        self.broadcast_message(command[12:])
+
+    def broadcast_message(self, message: Union[str, bytes, memoryview]) -> None:
+        """
+        Send a message to the whole network.
+
+        :param message: Text, or any bytes-like object that is sent as it is.
+        """
+        for broadcast_packet in PacketFactory.new_message_packets(message, self.address, self.version):
+            self.send_broadcast_packet(broadcast_packet)
 
     def run(self):
         """
@@ -145,6 +193,8 @@ class Peer:
             3. Parse user_interface_buffer to make message packets.
             4. Send packets stored in nodes buffer of our Stream object.
             5. ** sleep the current thread for 2 seconds **
+               In event driven mode, wait for Stream activity instead; it is set when a packet is received,
+               a user command arrives or a packet is buffered to be sent (e.g. by the Reunion daemon).
 
         Warnings:
             1. At first check reunion daemon condition; Maybe we have a problem in this time
@@ -155,14 +205,14 @@ class Peer:
         """
         try:
             while True:
-                in_buff = self.stream.read_in_buf()
-                for message in in_buff:
-                    packet = PacketFactory.parse_buffer(message)
+                for packet in PacketFactory.parse_buffers(self.stream.read_in_buf()):
                     self.handle_packet(packet)
-                self.stream.clear_in_buff()
                 self.handle_user_interface_buffer()
                 self.stream.send_out_buf_messages(self.reunion_mode == ReunionMode.FAILED)
-                time.sleep(2)
+                if self.event_driven:
+                    self.stream.wait_for_activity(MAX_IDLE_TIME)
+                else:
+                    time.sleep(2)
         except KeyboardInterrupt:
             log('KeyboardInterrupt')
             try:
@@ -203,15 +253,11 @@ class Peer:
             time.sleep(4)
 
     def __run_root_reunion_daemon(self):
-        graph_nodes = self.network_graph.nodes
-        for graph_node in graph_nodes:
-            if graph_node.address == self.address:
-                continue
+        for graph_node in self.network_graph.pop_expired_nodes(MAX_HELLO_INTERVAL):
             time_passed_since_last_hello = time.time() - graph_node.last_hello
             log(f'Time passed since last hello from Node({graph_node.address}): {time_passed_since_last_hello}')
-            if time_passed_since_last_hello > MAX_HELLO_INTERVAL:
-                self.stream.remove_node(self.stream.get_node_by_address(graph_node.address[0], graph_node.address[1]))
-                self.network_graph.remove_node(graph_node.address)
+            self.stream.remove_node(self.stream.get_node_by_address(graph_node.address[0], graph_node.address[1]))
+            self.network_graph.remove_node(graph_node.address)
 
     def __run_non_root_reunion_daemon(self):
         time_between_last_hello_and_last_hello_back = self.last_hello_time - self.last_hello_back_time
@@ -223,7 +269,7 @@ class Peer:
             time.sleep(3)
         else:
             log(f'Sending new Reunion Hello packet.')
-            packet = PacketFactory.new_reunion_packet(ReunionType.REQ, self.address, [self.address])
+            packet = PacketFactory.new_reunion_packet(ReunionType.REQ, self.address, [self.address], self.version)
             self.stream.add_message_to_out_buff(self.parent_address, packet)
             self.last_hello_time = time.time()
 
@@ -240,10 +286,33 @@ class Peer:
 
         :return:
         """
-        for neighbor_address in [*self.children_addresses, self.parent_address]:
-            if neighbor_address:
-                self.stream.add_message_to_out_buff(neighbor_address, broadcast_packet)
-                log(f'Message packet added to out buff of Node({neighbor_address}).')
+        neighbours = [address for address in [*self.children_addresses, self.parent_address] if address]
+        self.__send_message_packet(broadcast_packet, neighbours)
+        for neighbor_address in neighbours:
+            log(f'Message packet added to out buff of Node({neighbor_address}).')
+
+    def __send_message_packet(self, packet: Packet, neighbours: List[Address]) -> None:
+        """
+        Add a Message packet to the out buffers of 'neighbours'; Neighbours that negotiated compression get it
+        compressed and the others plain, and each form is made at most once.
+
+        :param packet: A Message packet, compressed or not.
+        :param neighbours: Addresses of the neighbours.
+        """
+        plain = compressed = None
+        if packet.is_compressed():
+            compressed = packet
+        else:
+            plain = packet
+        for neighbor_address in neighbours:
+            if neighbor_address in self.compression_neighbours:
+                if compressed is None:
+                    compressed = PacketFactory.compress_message(plain)
+                self.stream.add_message_to_out_buff(neighbor_address, compressed)
+            else:
+                if plain is None:
+                    plain = PacketFactory.decompress_message(compressed)
+                self.stream.add_message_to_out_buff(neighbor_address, plain)
 
     def handle_packet(self, packet):
         """
@@ -279,7 +348,8 @@ class Peer:
 
     @staticmethod
     def __validate_received_packet(packet: Packet) -> bool:
-        if packet.get_length() != len(packet.get_body()):
+        # Compare with the size on the wire, so a packet that is only forwarded is never decoded.
+        if packet.get_length() != packet.get_body_size():
             return False
         # TODO: More conditions
         return True
@@ -333,7 +403,7 @@ class Peer:
             self.__handle_advertise_response(packet)
 
     def __identify_advertise_type(self, packet: Packet) -> AdvertiseType:
-        advertise_type = packet.get_body()[:3]
+        advertise_type = packet.get_sub_type()
         return AdvertiseType(advertise_type)
 
     def __handle_advertise_request(self, packet: Packet) -> None:
@@ -345,7 +415,7 @@ class Peer:
         advertised_address = self.__get_neighbour(sender_address)
         log(f'Advertising Node({advertised_address}) to Node({sender_address}).')
         advertise_response_packet = PacketFactory.new_advertise_packet(AdvertiseType.RES, self.address,
-                                                                       advertised_address)
+                                                                       advertised_address, self.version)
         self.stream.add_message_to_out_buff(sender_address, advertise_response_packet, want_register=True)
         # Add to network_graph
         self.network_graph.add_node(sender_semi_node.get_ip(), sender_semi_node.get_port(), advertised_address)
@@ -356,7 +426,7 @@ class Peer:
         parent_address = packet.get_advertised_address()
         log(f'Trying to join Node({parent_address})...')
         self.parent_address = parent_address
-        join_packet = PacketFactory.new_join_packet(self.address)
+        join_packet = PacketFactory.new_join_packet(self.address, self.version, self.__capabilities())
         self.stream.add_node(parent_address)  # Add a non_register Node to stream to the parent
         log(f'Join Request added to out buf on Node({parent_address}).')
         self.stream.add_message_to_out_buff(parent_address, join_packet)
@@ -387,13 +457,13 @@ class Peer:
             self.registered.append(new_node)
             sender_address = packet.get_source_server_address()
             self.stream.add_node(sender_address, set_register_connection=True)
-            register_response_packet = PacketFactory.new_register_packet(RegisterType.RES, self.address)
+            register_response_packet = PacketFactory.new_register_packet(RegisterType.RES, self.address, self.version)
             self.stream.add_message_to_out_buff(sender_address, register_response_packet, want_register=True)
         elif register_type == RegisterType.RES:
             log('Register request ACKed by root. You are now registered.')
 
     def __identify_register_type(self, packet: Packet) -> RegisterType:
-        register_type = packet.get_body()[:3]
+        register_type = packet.get_sub_type()
         return RegisterType(register_type)
 
     def __check_neighbour(self, address: Address) -> bool:
@@ -427,13 +497,27 @@ class Peer:
 
         :return:
         """
-        log(f'New message arrived: {packet.get_body()}')
         sender_address = packet.get_source_server_address()
-        updated_packet = PacketFactory.new_message_packet(packet.get_body(), self.address)
+        if packet.is_fragment():
+            message_id, offset, total, chunk = packet.get_fragment()
+            message = self.reassembler.add((sender_address, message_id), offset, total, chunk)
+        else:
+            try:
+                message = packet.get_body_bytes()
+            except ValueError as e:
+                # e.g. A compressed body that would expand beyond FRAGMENT_SIZE; Don't relay it either.
+                log(f'Message packet dropped: {e}')
+                return
+        if message is not None:
+            log(f'New message arrived: {str(message, "utf-8", "replace")}')
+            if self.on_message:
+                self.on_message(message)
         if self.__check_neighbour(sender_address):  # From known source
-            for neighbor_address in [*self.children_addresses, self.parent_address]:
-                if neighbor_address is not None and neighbor_address != sender_address:
-                    self.stream.add_message_to_out_buff(neighbor_address, updated_packet)
+            # Relay the received packet itself (compressed or not); Only its source fields are rewritten.
+            # Fragments are relayed as they come, before their message is complete.
+            packet.set_source_server_address(self.address)
+            self.__send_message_packet(packet, [address for address in [*self.children_addresses, self.parent_address]
+                                                if address is not None and address != sender_address])
 
     def __handle_reunion_packet(self, packet: Packet):
         """
@@ -469,34 +553,31 @@ class Peer:
                 self.__handle_reunion_hello_back(packet)
 
     def __update_last_reunion(self, packet: Packet):
-        sender_address = packet.get_addresses()[0]
-        next_node = packet.get_addresses()[-1]
+        sender_address = packet.get_address(0)
+        next_node = packet.get_address(-1)
         self.network_graph.keep_alive(sender_address)
         log(f'New Hello from Node({sender_address}).')
         log(f'HelloBack added to out buf of Node({next_node})')
 
     def __respond_to_reunion(self, packet: Packet):
         reversed_addresses = packet.get_addresses_in_reverse()
-        response_packet = PacketFactory.new_reunion_packet(ReunionType.RES, self.address, reversed_addresses)
+        response_packet = PacketFactory.new_reunion_packet(ReunionType.RES, self.address, reversed_addresses,
+                                                           self.version)
         next_node_address = reversed_addresses[0]
         self.stream.add_message_to_out_buff(next_node_address, response_packet)
 
     def __identify_reunion_type(self, packet: Packet) -> ReunionType:
-        reunion_type = packet.get_body()[:3]
+        reunion_type = packet.get_sub_type()
         return ReunionType(reunion_type)
 
     def __pass_reunion_hello(self, packet: Packet):
-        new_addresses = self.__format_reunion_hello_addresses_on_pass(packet)
-        request_packet = PacketFactory.new_reunion_packet(ReunionType.REQ, self.address, new_addresses)
-        self.stream.add_message_to_out_buff(self.parent_address, request_packet)
-
-    def __format_reunion_hello_addresses_on_pass(self, packet: Packet) -> List[Address]:
-        addresses = packet.get_addresses()
-        addresses.append(self.address)
-        return addresses
+        # Edit the received packet instead of building a new one; Only our own entry is encoded.
+        packet.append_address(self.address)
+        packet.set_source_server_address(self.address)
+        self.stream.add_message_to_out_buff(self.parent_address, packet)
 
     def __handle_reunion_hello_back(self, packet: Packet):
-        if packet.get_addresses()[-1] == self.address:
+        if packet.get_address(-1) == self.address:
             # It's our hello back!
             self.last_hello_back_time = time.time()
             log('We received our HelloBack.')
@@ -504,11 +585,11 @@ class Peer:
             self.__pass_reunion_hello_back(packet)
 
     def __pass_reunion_hello_back(self, packet: Packet):
-        new_addresses = packet.get_addresses()[1:]
-        next_node_address = new_addresses[0]
+        packet.pop_address(0)
+        next_node_address = packet.get_address(0)
         log(f'HelloBack packet passed down to Node({next_node_address}).')
-        passed_packet = PacketFactory.new_reunion_packet(ReunionType.RES, self.address, new_addresses)
-        self.stream.add_message_to_out_buff(next_node_address, passed_packet)
+        packet.set_source_server_address(self.address)
+        self.stream.add_message_to_out_buff(next_node_address, packet)
 
     def __handle_join_packet(self, packet: Packet):
         """
@@ -523,9 +604,29 @@ class Peer:
         :return:
         """
         new_member_address = packet.get_source_server_address()
+        shared_capabilities = [capability for capability in packet.get_capabilities()
+                               if capability in self.__capabilities()]
+        if packet.is_join_ack():
+            # Our parent's answer to the capabilities of our Join.
+            if CAPABILITY_COMPRESSION in shared_capabilities:
+                self.compression_neighbours.add(new_member_address)
+            return
         log(f'New JOIN packet from Node({new_member_address}).')
         self.stream.add_node(new_member_address)
         self.children_addresses.append(new_member_address)
+        if shared_capabilities:
+            if CAPABILITY_COMPRESSION in shared_capabilities:
+                self.compression_neighbours.add(new_member_address)
+            ack_packet = PacketFactory.new_join_packet(self.address, self.version, shared_capabilities, ack=True)
+            self.stream.add_message_to_out_buff(new_member_address, ack_packet)
+
+    def __capabilities(self) -> List[str]:
+        """
+
+        :return: Capabilities that we offer on Join.
+        :rtype: list
+        """
+        return [CAPABILITY_COMPRESSION] if self.compression else []
 
     def __get_neighbour(self, sender: Address) -> Address:
         """
@@ -1,33 +1,99 @@
+import asyncio
 import threading
-from typing import Callable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional
 
-from src.Packet import Packet
+from src.Packet import MAX_FRAME_SIZE, Packet, PacketFactory, PacketType
+from src.tools.Dialer import Connection, Dialer, LinkDown
+from src.tools.IngressQueue import IngressQueue, OverflowPolicy
 from src.tools.Node import Node
 from src.tools.parsers import parse_ip
+from src.tools.simpletcp.asyncclient import AsyncClientSocket
+from src.tools.simpletcp.asyncserver import AsyncTCPServer
+from src.tools.simpletcp.clientsocket import ClientSocket
+from src.tools.simpletcp.duplexclient import DuplexClient
+from src.tools.simpletcp.responsequeue import ReplyClient, ResponseQueue
 from src.tools.simpletcp.tcpserver import TCPServer
 from src.tools.type_repo import Address
 from tools.logger import log
 
 
+# Listen backlog of our TCPServer; A root has to accept a lot of register connections at once.
+SERVER_BACKLOG = 128
+# 'selectors' uses epoll on Linux, so serving thousands of connections doesn't cost more per loop iteration.
+SERVER_BACKEND = 'selectors'
+# Maximum number of received packets waiting to be handled.
+IN_BUF_SIZE = 4096
+# Packet types that may be dropped with OverflowPolicy.DROP_BY_TYPE; Reunion Hellos are sent again anyway.
+DROPPABLE_TYPES = (PacketType.REUNION,)
+# Connect timeout of dialled connections (seconds), when there is no send_timeout.
+DIAL_TIMEOUT = 5
+
+
+class TransportMode(Enum):
+    THREADED = 'threaded'
+    ASYNCIO = 'asyncio'
+
+
 class Stream:
 
-    def __init__(self, ip: str, port: int):
+    def __init__(self, ip: str, port: int, transport: TransportMode = TransportMode.THREADED, ack_window: int = 1,
+                 in_buf_size: int = IN_BUF_SIZE, overflow_policy: OverflowPolicy = None,
+                 in_buf_batch: Optional[int] = None, writers: int = 0, send_timeout: Optional[float] = None,
+                 reconnect_attempts: int = 0, bidirectional: bool = False):
         """
         The Stream object constructor.
 
         Code design suggestion:
             1. Make a separate Thread for your TCPServer and start immediately.
 
+        Transport modes:
+            THREADED: A select based TCPServer thread and a blocking ClientSocket for every Node.
+            ASYNCIO: One event loop thread serves the AsyncTCPServer and every Node connection.
+
 
         :param ip: str
         :param port: int
+        :param transport: TransportMode
+        :param ack_window: Packets a Node may send before waiting for ACKs; 1 keeps the stop-and-wait behaviour.
+        :param in_buf_size: Capacity of the TCPServer input buffer.
+        :param overflow_policy: What to do with packets when the input buffer is full; By default the server blocks,
+                                except in ASYNCIO mode where blocking the event loop would stall our own Nodes too,
+                                so the oldest packets are dropped instead.
+        :param in_buf_batch: Maximum number of packets read_in_buf returns at once; None means all of them.
+        :param writers: Number of writer threads that drain Nodes concurrently; 0 sends to Nodes one by one on the
+                        caller's thread.
+        :param send_timeout: Deadline in seconds for every connect/send/receive of a Node; A Node that misses it
+                             is removed like any other broken Node.
+        :param reconnect_attempts: If positive, Node connections are made by a Dialer: they connect in the
+                                   background, are shared by the Nodes of the same address and are reconnected
+                                   with backoff up to this many times before the Node is removed.
+        :param bidirectional: Use one connection per neighbour in both directions: a Node of a neighbour that has
+                              connected to us sends on that connection through our server, and packets the other
+                              side sends back on our own connections are received like any other packet.
+                              Every peer of the network must use the same setting.
         """
 
         self.ip = parse_ip(ip)
         self.port = port
 
         self.nodes: List[Node] = []
-        self._server_in_buf: List[bytearray] = []
+        if overflow_policy is None:
+            overflow_policy = OverflowPolicy.DROP_OLDEST if transport == TransportMode.ASYNCIO \
+                else OverflowPolicy.BLOCK
+        self._server_in_buf = IngressQueue(in_buf_size, overflow_policy, PacketFactory.get_frame_type,
+                                           DROPPABLE_TYPES)
+        self.in_buf_batch = in_buf_batch
+        self.send_timeout = send_timeout
+        self.writer_pool = ThreadPoolExecutor(writers, thread_name_prefix='NodeWriter') if writers > 0 else None
+        # Set whenever there is something new to do: a received packet or a message waiting to be sent.
+        self.activity = threading.Event()
+        self.dialer = Dialer(self.__connect, self.activity.set, reconnect_attempts) \
+            if reconnect_attempts > 0 else None
+        self.bidirectional = bidirectional
+        # Response queues of the connections that neighbours opened to our server, by their server address.
+        self.__inbound: Dict[Address, ResponseQueue] = {}
 
         def callback(address, queue, data):
             """
@@ -35,17 +101,58 @@ class Stream:
 
             :param address: Source address.
             :param queue: Response queue.
-            :param data: The data received from the socket.
+            :param data: One complete packet received from the socket.
             :return:
             """
             log('New data received.')
             queue.put(bytes('ACK', 'utf8'))
-            self._server_in_buf.append(data)
+            if self.bidirectional:
+                self.__inbound[PacketFactory.get_frame_source(data)] = queue
+            self.__deliver(data)
 
         # ServerThread(ip, port, callback).start()
         formatted_ip = ".".join(str(int(part)) for part in ip.split("."))
-        self.tcp = TCPServer(formatted_ip, port, callback)
-        self.th = threading.Thread(target=self.tcp.run).start()
+        self.transport = transport
+        self.ack_window = ack_window
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        if transport == TransportMode.ASYNCIO:
+            self.loop = asyncio.new_event_loop()
+            self.th = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self.th.start()
+            self.tcp = AsyncTCPServer(formatted_ip, port, callback, maximum_connections=SERVER_BACKLOG,
+                                      measure_frame=PacketFactory.get_frame_size, max_frame_size=MAX_FRAME_SIZE)
+            # Wait for the bind, so address errors show up here like in the threaded mode.
+            asyncio.run_coroutine_threadsafe(self.tcp.start(), self.loop).result()
+        else:
+            self.tcp = TCPServer(formatted_ip, port, callback, maximum_connections=SERVER_BACKLOG,
+                                 measure_frame=PacketFactory.get_frame_size, backend=SERVER_BACKEND,
+                                 max_frame_size=MAX_FRAME_SIZE)
+            self.th = threading.Thread(target=self.tcp.run).start()
+
+    def __deliver(self, data) -> None:
+        """
+        Add a received packet to our input buffer.
+        """
+        if not self._server_in_buf.put(data):
+            log('Input buffer is full. Packet dropped.')
+        self.activity.set()
+
+    def __make_client(self, ip: str, port: int, timeout: Optional[float] = None):
+        if self.transport == TransportMode.ASYNCIO:
+            client = AsyncClientSocket(ip, port, self.loop, timeout=timeout)
+        else:
+            client = ClientSocket(ip, port, single_use=False, timeout=timeout)
+        if self.bidirectional:
+            # The other side may send its packets back on this connection.
+            client = DuplexClient(client, PacketFactory.get_frame_size, self.__deliver, timeout=self.send_timeout,
+                                  max_frame_size=MAX_FRAME_SIZE)
+        return client
+
+    def __connect(self, ip: str, port: int):
+        """
+        Client factory of our Dialer.
+        """
+        return self.__make_client(ip, port, self.send_timeout or DIAL_TIMEOUT)
 
     def get_server_address(self) -> Address:
         """
@@ -55,6 +162,20 @@ class Stream:
         """
         return self.ip, self.port
 
+    def wait_for_activity(self, timeout: float) -> bool:
+        """
+        Block until new data is received, a message is added to an out buffer or 'timeout' seconds have passed.
+
+        :param timeout: Maximum time to wait in seconds.
+
+        :return: Whether we were woken up by an activity.
+        :rtype: bool
+        """
+        woken = self.activity.wait(timeout)
+        # Anything that happens from now on will be seen by the next wait.
+        self.activity.clear()
+        return woken
+
     def clear_in_buff(self) -> None:
         """
         Discard any data in TCPServer input buffer.
@@ -66,6 +187,7 @@ class Stream:
     def add_node(self, server_address: Address, set_register_connection: bool = False) -> bool:
         """
         Will add new a node to our Stream.
+        If we already have a node of the same address and kind, it is kept instead.
 
         :param server_address: New node TCPServer address.
         :param set_register_connection: Shows that is this connection a register_connection or not.
@@ -75,8 +197,21 @@ class Stream:
 
         :return:
         """
+        if self.get_node_by_address(server_address[0], server_address[1], set_register_connection):
+            return True
+        address = (parse_ip(server_address[0]), server_address[1])
         try:
-            node = Node(server_address, set_register=set_register_connection)
+            if address in self.__inbound:
+                # It has connected to us; Send on that connection.
+                client_factory = lambda ip, port: ReplyClient(lambda: self.__inbound.get(address))
+            elif self.dialer:
+                client_factory = self.dialer.dial
+            elif self.transport == TransportMode.ASYNCIO or self.bidirectional:
+                client_factory = lambda ip, port: self.__make_client(ip, port, self.send_timeout)
+            else:
+                client_factory = None
+            node = Node(server_address, set_register=set_register_connection, client_factory=client_factory,
+                        window=self.ack_window, timeout=self.send_timeout)
         except:
             log(f"Wrong address. Cannot connect to {server_address}")
             return False
@@ -140,15 +275,21 @@ class Stream:
         node = self.get_node_by_address(ip, port, want_register)
         if node:
             node.add_message_to_out_buff(message)
+            self.activity.set()
 
-    def read_in_buf(self) -> List[bytearray]:
+    def read_in_buf(self) -> List[memoryview]:
         """
-        Only returns the input buffer of our TCPServer.
+        Takes the next batch of packets out of the input buffer of our TCPServer.
+        Packets received meanwhile stay in the buffer for the next call, so there is no need to clear it.
 
-        :return: TCPServer input buffer.
+        :return: Received packets, in arrival order.
         :rtype: list
         """
-        return self._server_in_buf
+        batch = self._server_in_buf.drain(self.in_buf_batch)
+        if len(self._server_in_buf):
+            # There is more to read; don't let the main loop wait.
+            self.activity.set()
+        return batch
 
     def send_messages_to_node(self, node: Node):
         """
@@ -164,7 +305,14 @@ class Stream:
         :return:
         """
         try:
-            node.send_message()
+            if isinstance(node.client, Connection):
+                # The connection may be shared with another Node of the same address.
+                with node.client.lock:
+                    node.send_message()
+            else:
+                node.send_message()
+        except LinkDown as e:
+            log(f'{e} Messages of Node({node.get_server_address()}) will be sent after reconnecting.')
         except:
             self.remove_node(node)
 
@@ -172,14 +320,38 @@ class Stream:
         """
         In this function, we will send hole out buffers to their own clients.
 
+        With a writer pool, every Node is handed to its own writer and we return without waiting, so a slow or
+        hung neighbour only delays itself; A Node that is still being written is left to its current writer.
+
         :return:
         """
-        for node in self.nodes:
-            if only_register:
-                if node.is_register:
-                    self.send_messages_to_node(node)
-            else:
+        for node in list(self.nodes):
+            if only_register and not node.is_register:
+                continue
+            if isinstance(node.client, Connection) and not node.client.is_ready():
+                # Still connecting; The Dialer will wake us up when it's done.
+                continue
+            if self.writer_pool is None:
                 self.send_messages_to_node(node)
+            elif node.has_messages() and node.writer_lock.acquire(blocking=False):
+                self.writer_pool.submit(self.__write_node, node)
+
+    def __write_node(self, node: Node):
+        """
+        Runs on a writer thread.
+
+        :param node: A Node whose writer_lock we hold.
+        :type node Node
+
+        :return:
+        """
+        try:
+            self.send_messages_to_node(node)
+        finally:
+            node.writer_lock.release()
+        if node.has_messages() and node in self.nodes:
+            # Packets were added while we were writing; ask for another round.
+            self.activity.set()
 
 
 class ServerThread(threading.Thread):
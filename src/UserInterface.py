@@ -5,10 +5,19 @@ from typing import List
 class UserInterface(threading.Thread):
     buffer: List[str] = []
 
+    def __init__(self, activity: threading.Event = None) -> None:
+        """
+        :param activity: If given, it will be set on every new command to wake up whoever is waiting for commands.
+        """
+        threading.Thread.__init__(self)
+        self.activity = activity
+
     def run(self):
         while True:
             message = input("Write your command:\n")
             self.buffer.append(message)
+            if self.activity:
+                self.activity.set()
 
     def clear_buffer(self) -> None:
         self.buffer.clear()
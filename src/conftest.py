@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other as src.tools and, like when they are run from src, as tools.
+sys.path.append(os.path.dirname(__file__))
@@ -0,0 +1,146 @@
+import struct
+import zlib
+
+import pytest
+
+from src.Packet import COMPRESSION_DICTIONARY, FLAG_COMPRESSED, FRAGMENT_SIZE, HEADER_SIZES, HEADER_STRUCT, \
+    HEADER_STRUCT_V2, VERSION, VERSION_2, AdvertiseType, Packet, PacketFactory, PacketType, RegisterType, \
+    ReunionType, decode_address, encode_address
+
+SOURCE = ('192.168.001.010', 5335)
+
+
+def parse_one_by_one(buffers):
+    packets = []
+    for buffer in buffers:
+        try:
+            packet = PacketFactory.parse_buffer(buffer)
+        except (ValueError, struct.error):
+            continue
+        if packet.get_length() == packet.get_body_size():
+            packets.append(packet)
+    return packets
+
+
+def describe(packets):
+    return [(packet.get_version(), packet.get_type(), packet.get_length(), packet.get_source_server_address(),
+             packet.get_buf()) for packet in packets]
+
+
+def test_parse_buffers_matches_parse_buffer():
+    valid = []
+    for version in (VERSION, VERSION_2):
+        valid.append(PacketFactory.new_message_packet('Hello', SOURCE, version).get_buf())
+        valid.append(PacketFactory.new_reunion_packet(ReunionType.REQ, SOURCE, [SOURCE] * 3, version).get_buf())
+        valid.append(PacketFactory.new_join_packet(SOURCE, version).get_buf())
+    malformed = [
+        HEADER_STRUCT.pack(9, 4, 0, 192, 168, 1, 10, 5335),  # Unknown version
+        HEADER_STRUCT.pack(1, 99, 0, 192, 168, 1, 10, 5335),  # Unknown type
+        HEADER_STRUCT.pack(1, 4, 10, 192, 168, 1, 10, 5335) + b'short',  # Length doesn't match
+        valid[0][:10],  # Cut in the header
+        b'',
+    ]
+    buffers = [buffer for pair in zip(valid, malformed + [valid[0]]) for buffer in pair] * 20
+    packets = PacketFactory.parse_buffers(buffers)
+    assert describe(packets) == describe(parse_one_by_one(buffers))
+    assert len(packets) == len(valid) * 20 + 20
+
+
+def compressed_message_packet(body: bytes) -> Packet:
+    # Made by hand; compress_message only compresses bodies that fit in one packet.
+    compressor = zlib.compressobj(zdict=COMPRESSION_DICTIONARY)
+    compressed = compressor.compress(body) + compressor.flush()
+    return Packet(VERSION, PacketType.MESSAGE, len(compressed), *SOURCE, compressed, flags=FLAG_COMPRESSED)
+
+
+def test_compressed_message_round_trip():
+    body = b'x' * FRAGMENT_SIZE
+    packet = PacketFactory.compress_message(PacketFactory.new_message_packet(body, SOURCE))
+    assert packet.is_compressed()
+    received = PacketFactory.parse_buffer(packet.get_buf())
+    assert received.get_body_bytes() == body
+    plain = PacketFactory.new_message_packet(body, SOURCE)
+    assert PacketFactory.decompress_message(received).get_buf() == plain.get_buf()
+
+
+def test_compressed_body_bigger_than_a_fragment_is_refused():
+    # Fits in one frame, but would relay a frame of 4 MB.
+    packet = PacketFactory.parse_buffer(compressed_message_packet(b'\0' * 4 * 1024 * 1024).get_buf())
+    assert packet.get_length() < FRAGMENT_SIZE
+    with pytest.raises(ValueError):
+        packet.get_body_bytes()
+    with pytest.raises(ValueError):
+        PacketFactory.decompress_message(packet)
+    with pytest.raises(ValueError):
+        PacketFactory.parse_buffer(compressed_message_packet(b'\0' * (FRAGMENT_SIZE + 1)).get_buf()).get_body_bytes()
+
+
+def test_message_packet_bigger_than_a_fragment_is_refused():
+    with pytest.raises(ValueError):
+        PacketFactory.new_message_packet(b'x' * (FRAGMENT_SIZE + 1), SOURCE)
+    packets = PacketFactory.new_message_packets(b'x' * (FRAGMENT_SIZE + 1), SOURCE)
+    assert [packet.is_fragment() for packet in packets] == [True, True]
+
+
+def test_address_is_six_bytes_in_version_2():
+    for address in [('000.000.000.000', 0), ('192.168.001.010', 5335), ('255.255.255.255', 65535)]:
+        encoded = encode_address(address)
+        assert len(encoded) == 6
+        assert decode_address(b'x' + encoded, 1) == address
+    assert encode_address(('10.0.0.1', 80)) == bytes([10, 0, 0, 1, 0, 80])
+
+
+def test_version_2_header_round_trip():
+    packet = PacketFactory.new_message_packet('Hello', ('10.0.0.1', 65535), VERSION_2)
+    buf = packet.get_buf()
+    assert len(buf) == HEADER_SIZES[VERSION_2] + 5
+    assert HEADER_STRUCT_V2.unpack_from(buf) == (VERSION_2, 4, 5, 10, 0, 0, 1, 65535)
+    parsed = PacketFactory.parse_buffer(buf)
+    assert (parsed.get_version(), parsed.get_type(), parsed.get_length()) == (VERSION_2, PacketType.MESSAGE, 5)
+    assert parsed.get_source_server_address() == ('010.000.000.001', 65535)
+    assert parsed.get_body() == 'Hello'
+    assert PacketFactory.get_frame_size(memoryview(buf)) == len(buf)
+    assert PacketFactory.get_frame_source(buf) == ('010.000.000.001', 65535)
+
+
+def test_version_2_bodies_round_trip():
+    neighbour = ('192.168.001.020', 6000)
+    path = [SOURCE, neighbour, ('010.000.000.001', 1)]
+    register = PacketFactory.parse_buffer(PacketFactory.new_register_packet(RegisterType.REQ, SOURCE,
+                                                                              VERSION_2).get_buf())
+    assert register.get_length() == 7 and register.get_sub_type() == 'REQ'
+    assert decode_address(register.get_raw_body(), 1) == SOURCE
+    advertise = PacketFactory.parse_buffer(PacketFactory.new_advertise_packet(AdvertiseType.RES, SOURCE, neighbour,
+                                                                                VERSION_2).get_buf())
+    assert advertise.get_sub_type() == 'RES' and advertise.get_advertised_address() == neighbour
+    reunion = PacketFactory.parse_buffer(PacketFactory.new_reunion_packet(ReunionType.RES, SOURCE, path,
+                                                                            VERSION_2).get_buf())
+    assert reunion.get_length() == 3 + 6 * len(path)
+    assert reunion.get_sub_type() == 'RES' and reunion.get_n_entries() == len(path)
+    assert reunion.get_addresses() == path
+
+
+@pytest.mark.parametrize('version', [VERSION, VERSION_2])
+@pytest.mark.parametrize('decoded', [False, True])
+def test_reunion_path_edited_in_place(version, decoded):
+    path = [('010.000.000.%03d' % index, 5000 + index) for index in range(4)]
+    packet = PacketFactory.parse_buffer(PacketFactory.new_reunion_packet(ReunionType.REQ, SOURCE, path,
+                                                                           version).get_buf())
+    if decoded:
+        # The edits must keep the decoded path too.
+        packet.get_addresses()
+    packet.append_address(('10.0.0.9', 5009))
+    assert packet.pop_address() == path[0]
+    assert packet.pop_address(-2) == path[3]
+    expected_path = [path[1], path[2], ('010.000.000.009', 5009)]
+    expected = PacketFactory.new_reunion_packet(ReunionType.REQ, SOURCE, expected_path, version)
+    assert packet.get_n_entries() == 3 and packet.get_length() == expected.get_length()
+    assert packet.get_addresses() == expected_path
+    assert packet.get_buf() == expected.get_buf()
+    assert PacketFactory.parse_buffer(packet.get_buf()).get_addresses() == expected_path
+
+
+def test_version_1_reunion_path_has_at_most_99_entries():
+    packet = PacketFactory.new_reunion_packet(ReunionType.REQ, SOURCE, [SOURCE] * 99)
+    with pytest.raises(ValueError):
+        packet.append_address(SOURCE)
@@ -0,0 +1,63 @@
+import socket
+
+import pytest
+
+from src.Packet import CAPABILITY_COMPRESSION, COMPRESSION_THRESHOLD, PacketFactory
+from src.Peer import Peer
+from src.Stream import TransportMode
+
+ROOT_ADDRESS = ('127.0.0.1', 5000)
+
+
+def new_peer(compression: bool) -> Peer:
+    # ASYNCIO mode, since its server thread is a daemon.
+    return Peer('127.0.0.1', 0, root_address=ROOT_ADDRESS, command_line=False, compression=compression,
+                transport=TransportMode.ASYNCIO)
+
+
+@pytest.fixture
+def child_server():
+    # Stands for the server of a child; Its Node connects to it.
+    server = socket.create_server(('127.0.0.1', 0))
+    yield '127.000.000.001', server.getsockname()[1]
+    server.close()
+
+
+def join(parent: Peer, child_address, capabilities):
+    join_packet = PacketFactory.new_join_packet(child_address, capabilities=capabilities)
+    parent.handle_packet(PacketFactory.parse_buffer(join_packet.get_buf()))
+    return parent.stream.get_node_by_address(*child_address).out_buff
+
+
+def broadcast(parent: Peer, child_address):
+    message = 'x' * COMPRESSION_THRESHOLD * 4
+    parent.send_broadcast_packet(PacketFactory.new_message_packet(message, parent.address))
+    return parent.stream.get_node_by_address(*child_address).out_buff[-1]
+
+
+def test_compression_is_negotiated_on_join(child_server):
+    parent = new_peer(compression=True)
+    sent = join(parent, child_server, [CAPABILITY_COMPRESSION])
+    assert parent.compression_neighbours == {child_server}
+    [ack] = sent
+    assert ack.is_join_ack() and ack.get_capabilities() == [CAPABILITY_COMPRESSION]
+    assert broadcast(parent, child_server).is_compressed()
+    # The child learns it from the answer.
+    child = new_peer(compression=True)
+    child.handle_packet(PacketFactory.parse_buffer(ack.get_buf()))
+    assert child.compression_neighbours == {parent.address}
+
+
+def test_no_compression_with_a_child_that_does_not_offer_it(child_server):
+    parent = new_peer(compression=True)
+    assert join(parent, child_server, []) == []
+    assert parent.compression_neighbours == set()
+    assert not broadcast(parent, child_server).is_compressed()
+
+
+def test_no_compression_with_a_parent_that_does_not_support_it(child_server):
+    parent = new_peer(compression=False)
+    # An old parent doesn't answer, so the child never compresses either.
+    assert join(parent, child_server, [CAPABILITY_COMPRESSION]) == []
+    assert parent.compression_neighbours == set()
+    assert not broadcast(parent, child_server).is_compressed()
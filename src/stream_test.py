@@ -0,0 +1,44 @@
+import socket
+import time
+
+from src.Packet import PacketFactory
+from src.Stream import Stream, TransportMode
+
+SOURCE = ('127.0.0.1', 5000)
+
+
+def new_stream(**options):
+    # ASYNCIO mode, since its server thread is a daemon.
+    stream = Stream('127.0.0.1', 0, TransportMode.ASYNCIO, **options)
+    return stream, ('127.0.0.1', stream.tcp._server.sockets[0].getsockname()[1])
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_hung_neighbour_does_not_delay_the_others():
+    sender, _ = new_stream(writers=2, send_timeout=2)
+    receiver, receiver_address = new_stream()
+    # Accepts connections, but never reads or ACKs.
+    hung = socket.create_server(('127.0.0.1', 0))
+    hung_address = ('127.0.0.1', hung.getsockname()[1])
+    try:
+        assert sender.add_node(hung_address)
+        assert sender.add_node(receiver_address)
+        packet = PacketFactory.new_message_packet('Hello', SOURCE)
+        sender.add_message_to_out_buff(hung_address, packet)
+        sender.add_message_to_out_buff(receiver_address, packet)
+        sender.send_out_buf_messages()
+        received = []
+        assert wait_for(lambda: received.extend(receiver.read_in_buf()) or received, 1)
+        assert [bytes(data) for data in received] == [packet.get_buf()]
+        # Its writer still waits for the ACK.
+        assert sender.get_node_by_address(*hung_address).writer_lock.locked()
+    finally:
+        hung.close()
@@ -0,0 +1,220 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from src.tools.type_repo import Address
+from tools.logger import log
+
+
+class LinkDown(ConnectionError):
+    """
+    The connection is not usable right now, but the Dialer is (re)connecting it; Try again later.
+    """
+
+
+class Connection:
+    def __init__(self, dialer: 'Dialer', ip: str, port: int):
+        """
+        A client connection that is shared by every Node of the same address and heals itself.
+
+        It offers the blocking API of a persistent ClientSocket (send, sendall, send_buffers, receive, close) on top
+        of whatever client the Dialer makes; While it is connecting or waiting to reconnect, these methods raise
+        LinkDown.
+
+        :param dialer: The Dialer that owns this connection.
+        :param ip: Server IP in the format that the client accepts.
+        :param port: Server port.
+        """
+        self.dialer = dialer
+        self.ip = ip
+        self.port = port
+        # Users must hold it for a whole exchange, since a register and a non-register Node may share us.
+        self.lock = threading.RLock()
+        self.users = 0
+        self.closed = False
+
+        self._client = None
+        self._error = None
+        self._failures = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+
+    def get_address(self) -> Address:
+        return self.ip, self.port
+
+    def has_failed(self) -> bool:
+        """
+
+        :return: Whether we gave up on connecting.
+        :rtype: bool
+        """
+        return self._error is not None
+
+    def is_ready(self) -> bool:
+        """
+
+        :return: Whether the connection is established (or has failed for good); i.e. using it won't raise LinkDown.
+        :rtype: bool
+        """
+        return self._ready.is_set()
+
+    def _dial(self) -> None:
+        """
+        Runs on the Dialer's threads; One connection attempt, and a retry with jittered exponential backoff if it fails.
+        """
+        if self._stop.is_set():
+            return
+        try:
+            client = self.dialer.client_factory(self.ip, self.port)
+        except OSError as e:
+            self._failures += 1
+            if self._failures <= self.dialer.max_attempts:
+                delay = self.dialer.backoff(self._failures)
+                log(f'Cannot connect to {self.get_address()}. Retrying in {delay:.2f} seconds...')
+                self.dialer.submit(self, delay)
+                return
+            log(f'Giving up on connecting to {self.get_address()}: {e}')
+            self._error = e
+        except Exception as e:
+            # e.g. A bad port; Retrying won't help, and the Connection must not stay not ready forever.
+            log(f'Giving up on connecting to {self.get_address()}: {e!r}')
+            self._error = e
+        else:
+            if self._stop.is_set():
+                client.close()
+                return
+            self._client = client
+            self._failures = 0
+        self._ready.set()
+        self.dialer.on_ready()
+
+    def _redial(self) -> None:
+        """
+        The current client is broken; Throw it away and connect again in the background.
+        """
+        with self.lock:
+            if not self._ready.is_set():
+                return
+            self._ready.clear()
+            client, self._client = self._client, None
+            if client:
+                try:
+                    client.close()
+                except OSError:
+                    pass
+            self.dialer.submit(self)
+
+    def _client_or_raise(self):
+        if not self._ready.is_set():
+            raise LinkDown(f'Connection to {self.get_address()} is not ready.')
+        if self._error is not None:
+            raise ConnectionError(f'Cannot connect to {self.get_address()}.') from self._error
+        return self._client
+
+    def __call(self, method: str, *args):
+        client = self._client_or_raise()
+        try:
+            result = getattr(client, method)(*args)
+        except OSError as e:
+            self._redial()
+            raise LinkDown(f'Connection to {self.get_address()} failed: {e}') from e
+        if result == b'':
+            # The server closed the connection.
+            self._redial()
+            raise LinkDown(f'Connection to {self.get_address()} was closed.')
+        return result
+
+    def send(self, data):
+        return self.__call('send', data)
+
+    def sendall(self, data):
+        return self.__call('sendall', data)
+
+    def send_buffers(self, buffers):
+        return self.__call('send_buffers', buffers)
+
+    def receive(self):
+        return self.__call('receive')
+
+    def close(self) -> None:
+        """
+        Release one user; The socket is really closed when its last user is gone.
+        """
+        with self.lock:
+            self.users -= 1
+            if self.users > 0 or self.closed:
+                return
+            self.closed = True
+            self._stop.set()
+            self.dialer.forget(self)
+            if self._client:
+                self._client.close()
+
+
+class Dialer:
+    def __init__(self, client_factory: Callable[[str, int], object], on_ready: Callable[[], None] = lambda: None,
+                 max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30, workers: int = 4):
+        """
+        Makes client connections in the background and keeps one Connection per server address.
+
+        :param client_factory: Makes and connects a client from (ip, port); It should have a timeout.
+        :param on_ready: Called (from a Dialer thread) every time a connection is established or given up.
+        :param max_attempts: Consecutive failed attempts before a connection fails for good.
+        :param base_delay: Backoff before the first retry, in seconds; It doubles with every failure.
+        :param max_delay: Upper bound of the backoff, in seconds.
+        :param workers: Number of threads that connect.
+        """
+        self.client_factory = client_factory
+        self.on_ready = on_ready
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._connections: Dict[Address, Connection] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='Dialer')
+
+    def dial(self, ip: str, port: int) -> Connection:
+        """
+        Get the connection to (ip, port); An existing one is reused, otherwise a new one starts connecting.
+
+        :return: A Connection with one more user; Call its close when you are done with it.
+        :rtype: Connection
+        """
+        with self._lock:
+            connection = self._connections.get((ip, port))
+            if connection is None or connection.has_failed():
+                connection = Connection(self, ip, port)
+                self._connections[(ip, port)] = connection
+                self.submit(connection)
+            connection.users += 1
+            return connection
+
+    def submit(self, connection: Connection, delay: float = 0) -> None:
+        """
+        Schedule a connection attempt; Waiting for the backoff doesn't hold one of our threads.
+        """
+        if delay <= 0:
+            self._pool.submit(connection._dial)
+            return
+        timer = threading.Timer(delay, self._pool.submit, (connection._dial,))
+        timer.daemon = True
+        timer.start()
+
+    def forget(self, connection: Connection) -> None:
+        with self._lock:
+            if self._connections.get(connection.get_address()) is connection:
+                del self._connections[connection.get_address()]
+
+    def backoff(self, failures: int) -> float:
+        """
+        Exponential backoff with jitter, so peers that lost the same neighbour don't all retry at once.
+
+        :param failures: Number of consecutive failures.
+
+        :return: Seconds to wait before the next attempt.
+        :rtype: float
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
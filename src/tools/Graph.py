@@ -1,5 +1,10 @@
+import functools
+import heapq
+import itertools
+import threading
 import time
-from typing import List, Optional
+from collections import deque
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
 
 from src.tools.logger import log
 from src.tools.parsers import parse_ip
@@ -14,6 +19,9 @@ class GraphNode:
         self.level: int = None
         self.is_alive = False
         self.last_hello = None
+        # Addresses of the node and its ancestors, and the NetworkGraph epoch they were computed in.
+        self.ancestors: Optional[FrozenSet[Address]] = None
+        self.ancestors_epoch = -1
 
     def set_parent(self, parent: 'GraphNode') -> None:
         self.parent = parent
@@ -60,20 +68,62 @@ def check_is_parent(child: GraphNode, parent: GraphNode) -> bool:
             return True
 
 
+def synchronized(method):
+    """
+    Run a NetworkGraph method under its lock; The graph is changed by the Peer main loop and the Reunion daemon.
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class NetworkGraph:
-    def __init__(self, root: GraphNode):
+    def __init__(self, root: GraphNode, on_change: Callable[[], None] = None):
+        """
+        :param root: The node of the root Peer.
+        :param on_change: Called whenever a node joins, moves, is removed or comes back to life; It must return at once
+                          (e.g. TopologyExporter.notify).
+        """
         self.root = root
+        self.on_change = on_change
         root.keep_alive()
         root.alive = True
-        self.nodes = [root]
+        # Every node by its address; Nodes of a removed sub-tree stay here (turned off) until they join again.
+        self._nodes: Dict[Address, GraphNode] = {root.address: root}
+        # Heap of the nodes that may take a child, with lazy deletion; Entries are (-level, -order, node), and
+        # _free_slot_entries has the valid entry of every node in it.
+        self._free_slots: List[Tuple[int, int, GraphNode]] = []
+        self._free_slot_entries: Dict[Address, Tuple[int, int, GraphNode]] = {}
+        self._free_slot_order = itertools.count()
+        self.__add_free_slot(root)
+        # Bumped whenever a node moves or is removed, so the ancestors of every node are computed again on demand.
+        self._epoch = 0
+        # Min-heap of every node but the root by its last hello when the entry was pushed, with lazy refresh (see
+        # pop_expired_nodes); _hello_entries has the valid entry of every node in it.
+        self._hellos: List[Tuple[float, int, GraphNode]] = []
+        self._hello_entries: Dict[Address, Tuple[float, int, GraphNode]] = {}
+        self._hello_order = itertools.count()
+        self._lock = threading.RLock()
+
+    @property
+    @synchronized
+    def nodes(self) -> List[GraphNode]:
+        """
+        :return: A copy of the list of nodes; The graph may be changed while it is iterated.
+        :rtype: list
+        """
+        return list(self._nodes.values())
 
+    @synchronized
     def find_live_node(self, sender: Address) -> Optional[Address]:
         """
         Here we should find a neighbour for the sender.
-        Best neighbour is the node who is nearest the root and has not more than one child.
+        Best neighbour is the deepest live node that has less than two children and is not at level 8.
 
-        Code design suggestion:
-            1. Do a BFS algorithm to find the target.
+        The candidates are kept in a heap (see __add_free_slot) instead of doing a BFS for every request; Entries of
+        nodes that are no longer candidates are dropped when they reach the top.
 
         Warnings:
             1. Check whether there is sender node in our NetworkGraph or not; if exist do not return sender node or
@@ -85,49 +135,103 @@ class NetworkGraph:
         :return: Best neighbour for sender.
         :rtype: GraphNode
         """
-        graph: List[GraphNode] = []
-        visited = {}
-        # Create a queue for BFS
-        # Mark the source node as visited and enqueue it
-        queue: List[GraphNode] = [self.root]
-        visited[self.root.address] = True
-        while queue:
-            # Dequeue a vertex from queue and print it
-            node = queue.pop(0)
-            graph.append(node)
-            # Get all adjacent vertices of the dequeued vertex node
-            # If a adjacent has not been visited, then mark it visited and enqueue it
-            for child in node.children:
-                if child.address not in visited or not visited[child.address]:
-                    queue.append(child)
-                    visited[child.address] = True
         sender_node = self.find_node(sender)  # For the warning
-        for node in graph[::-1]:
-            if node.level == 8 or len(node.children) == 2 or (not node.is_alive) or (
-                    sender_node and check_is_parent(node, sender_node)) or sender == node.address:
-                continue
-            return node.address
-        log('Network is full.')
+        skipped = []
+        try:
+            while self._free_slots:
+                entry = self._free_slots[0]
+                node = entry[2]
+                if self._free_slot_entries.get(node.address) is not entry or not self.__has_free_slot(node):
+                    heapq.heappop(self._free_slots)
+                    if self._free_slot_entries.get(node.address) is entry:
+                        del self._free_slot_entries[node.address]
+                    continue
+                if sender == node.address or (sender_node and self.is_in_subtree(node, sender_node)):
+                    # Still a candidate for other senders.
+                    skipped.append(heapq.heappop(self._free_slots))
+                    continue
+                return node.address
+            log('Network is full.')
+        finally:
+            for entry in skipped:
+                heapq.heappush(self._free_slots, entry)
+
+    def __has_free_slot(self, node: GraphNode) -> bool:
+        if node.level == 8 or len(node.children) >= 2 or not node.is_alive:
+            return False
+        return self.__ancestors(node) is not None
+
+    @synchronized
+    def is_in_subtree(self, node: GraphNode, ancestor: GraphNode) -> bool:
+        """
+        Same as check_is_parent(node, ancestor), for nodes that are connected to the root; Without walking up the
+        tree unless it has changed since the last query.
+
+        :return: Whether node is in the sub-tree of ancestor (and is not ancestor itself).
+        :rtype: bool
+        """
+        ancestors = self.__ancestors(node)
+        return ancestors is not None and node is not ancestor and ancestor.address in ancestors
+
+    def __ancestors(self, node: GraphNode) -> Optional[FrozenSet[Address]]:
+        """
+        :return: Addresses of node and its ancestors, or None if it is not connected to the root; i.e. it is in the
+                 sub-tree of a removed node.
+        """
+        if node.ancestors_epoch != self._epoch:
+            if node is self.root:
+                node.ancestors = frozenset((node.address,))
+            elif node.parent is None or self._nodes.get(node.address) is not node:
+                node.ancestors = None
+            else:
+                parent_ancestors = self.__ancestors(node.parent)
+                node.ancestors = None if parent_ancestors is None else parent_ancestors | {node.address}
+            node.ancestors_epoch = self._epoch
+        return node.ancestors
+
+    def __add_free_slot(self, node: GraphNode) -> None:
+        """
+        Make node a candidate of find_live_node; Called when it may have become one (i.e. it was added, lost a child,
+        was turned on or moved to another level).
+        Deeper nodes come first, and of the same level the one pushed last.
+        """
+        if self._nodes.get(node.address) is not node:
+            # Removed from the graph, maybe with a new node at its address.
+            return
+        level = node.level or 0
+        entry = self._free_slot_entries.get(node.address)
+        if entry is not None and entry[2] is node and entry[0] == -level:
+            return
+        entry = (-level, -next(self._free_slot_order), node)
+        self._free_slot_entries[node.address] = entry
+        heapq.heappush(self._free_slots, entry)
 
+    @synchronized
     def find_node(self, node_address: Address) -> Optional[GraphNode]:
-        for node in self.nodes:
-            if node_address == node.address:
-                return node
+        return self._nodes.get(node_address)
 
+    @synchronized
     def turn_on_node(self, node_address: Address) -> None:
-        self.find_node(node_address).is_alive = True
+        node = self.find_node(node_address)
+        node.is_alive = True
+        self.__add_free_slot(node)
 
+    @synchronized
     def turn_off_node(self, node_address: Address) -> None:
         self.find_node(node_address).is_alive = False
 
+    @synchronized
     def remove_node(self, node_address: Address) -> None:
         log(f'Node({node_address}) was REMOVED.')
         node = self.find_node(node_address)
         self.turn_off_subtree(node)
         node.parent.children.remove(node)
-        self.nodes.remove(node)
-        self.draw_graph()
+        del self._nodes[node_address]
+        self._epoch += 1
+        self.__add_free_slot(node.parent)
+        self.__changed()
 
+    @synchronized
     def turn_off_subtree(self, node: GraphNode):
         parents = [node]
         while True and len(parents) != 0:
@@ -139,6 +243,7 @@ class NetworkGraph:
                     log(f'Node({child}) was turned OFF.')
                 parents.remove(parent)
 
+    @synchronized
     def add_node(self, ip: str, port: int, father_address: Address) -> None:
         """
         Add a new node with node_address if it does not exist in our NetworkGraph and set its father.
@@ -162,29 +267,115 @@ class NetworkGraph:
         new_node_address = (parse_ip(ip), port)
         old_graph_node = self.find_node(new_node_address)
         if old_graph_node:
+            if old_graph_node.parent and old_graph_node in old_graph_node.parent.children:
+                # It is moving; Don't leave it as a child of its old parent too.
+                old_graph_node.parent.children.remove(old_graph_node)
+                self.__add_free_slot(old_graph_node.parent)
             old_graph_node.keep_alive()
             old_graph_node.set_parent(father_node)
+            self._epoch += 1
+            self.__track_hellos(old_graph_node)
             self.level_node(old_graph_node, father_node)
             father_node.add_child(old_graph_node)
+            # Its sub-tree is connected to the root again, maybe at other levels.
+            subtree = [old_graph_node]
+            while subtree:
+                node = subtree.pop()
+                self.__add_free_slot(node)
+                for child in node.children:
+                    self.level_node(child, node)
+                    subtree.append(child)
+            self.__changed()
             return
         new_node = GraphNode(new_node_address)
         new_node.set_parent(father_node)
         self.level_node(new_node, father_node)
         father_node.add_child(new_node)
-        self.nodes.append(new_node)
-        self.draw_graph()
+        self._nodes[new_node_address] = new_node
+        self.__add_free_slot(new_node)
+        self.__track_hellos(new_node)
+        self.__changed()
 
+    @synchronized
     def level_node(self, node: GraphNode, father_node: GraphNode) -> None:
         if father_node == self.root:
             node.set_level(1)
         else:
             node.set_level(father_node.level + 1)
 
+    @synchronized
     def keep_alive(self, address: Address) -> None:
         graph_node = self.find_node(address)
+        was_alive = graph_node.is_alive
         graph_node.keep_alive()
+        if address not in self._hello_entries and graph_node is not self.root:
+            self.__track_hellos(graph_node)
+        if not was_alive:
+            self.__add_free_slot(graph_node)
+            self.__changed()
+
+    def __track_hellos(self, node: GraphNode) -> None:
+        entry = (node.last_hello, next(self._hello_order), node)
+        self._hello_entries[node.address] = entry
+        heapq.heappush(self._hellos, entry)
+
+    @synchronized
+    def pop_expired_nodes(self, max_interval: float) -> List[GraphNode]:
+        """
+        Find the nodes whose last hello is more than max_interval seconds old; They are not tracked anymore, so the
+        caller should remove them.
+
+        keep_alive only updates the time of a node; When its old entry comes to the top of the heap, it is pushed
+        again with that time. So only the nodes whose entries expired are touched, whatever the size of the graph.
+
+        :param max_interval: Seconds.
+
+        :return: The expired nodes.
+        :rtype: list
+        """
+        deadline = time.time() - max_interval
+        expired = []
+        while self._hellos and self._hellos[0][0] < deadline:
+            entry = heapq.heappop(self._hellos)
+            node = entry[2]
+            if self._hello_entries.get(node.address) is not entry:
+                continue
+            del self._hello_entries[node.address]
+            if self._nodes.get(node.address) is not node:
+                continue
+            if node.last_hello >= deadline:
+                self.__track_hellos(node)
+            else:
+                expired.append(node)
+        return expired
+
+    def __changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change()
+
+    @synchronized
+    def snapshot(self) -> Dict:
+        """
+        The nodes that are connected to the root, in BFS order; For exporting the topology. Holds the graph lock, so
+        it is safe to call from another thread.
+
+        :return: {'time': ..., 'root': address, 'nodes': [{'address', 'parent', 'level', 'alive'}, ...]}
+        :rtype: dict
+        """
+        nodes = []
+        queue = deque([self.root])
+        while queue:
+            node = queue.popleft()
+            nodes.append({'address': node.address, 'parent': node.parent.address if node is not self.root else None,
+                          'level': node.level or 0, 'alive': node.is_alive})
+            queue.extend(node.children)
+        return {'time': time.time(), 'root': self.root.address, 'nodes': nodes}
 
     def draw_graph(self):
+        """
+        Show the graph in a window; It blocks until the window is closed, so it is for debugging only (see
+        TopologyExporter for snapshots of a running root).
+        """
         # Libraries
         # import numpy as np
         import pandas as pd
@@ -197,15 +388,17 @@ class NetworkGraph:
         # Build a dataframe with connections
         from_nodes = []
         to_nodes = []
-        parents = [self.root]
-        while True and len(parents) != 0:
-            parent = parents[0]
-            if parent:
-                for child in parent.children:
-                    from_nodes.append(parent.address.__str__())
-                    to_nodes.append(child.address.__str__())
-                    parents.append(child)
-                parents.remove(parent)
+        # Only the walk holds the lock; Not the window.
+        with self._lock:
+            parents = [self.root]
+            while True and len(parents) != 0:
+                parent = parents[0]
+                if parent:
+                    for child in parent.children:
+                        from_nodes.append(parent.address.__str__())
+                        to_nodes.append(child.address.__str__())
+                        parents.append(child)
+                    parents.remove(parent)
         from_nodes.reverse()
         to_nodes.reverse()
         df = pd.DataFrame({'from': from_nodes, 'to': to_nodes})
@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Collection, Deque, List, Optional
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'BLOCK'  # The producer waits for room; For a server thread this stops reading its sockets.
+    DROP_OLDEST = 'DROP_OLDEST'  # Discard the oldest queued item.
+    DROP_BY_TYPE = 'DROP_BY_TYPE'  # Discard an item of a droppable type; Block if there is none.
+
+
+class IngressQueue:
+    def __init__(self, max_size: int, policy: OverflowPolicy = OverflowPolicy.BLOCK,
+                 classify: Callable[[Any], Any] = None, droppable: Collection = ()):
+        """
+        A thread-safe bounded FIFO between a producer thread (our TCPServer) and a consumer that drains it in
+        batches (the Peer main loop); Nothing that was put is lost unless the overflow policy drops it.
+
+        :param max_size: Maximum number of queued items.
+        :param policy: What to do when the queue is full.
+        :param classify: Only for DROP_BY_TYPE; Returns the type of an item.
+        :param droppable: Only for DROP_BY_TYPE; The types that may be dropped.
+        """
+        if policy == OverflowPolicy.DROP_BY_TYPE and classify is None:
+            raise ValueError('DROP_BY_TYPE needs a classify function.')
+        self.max_size = max_size
+        self.policy = policy
+        self.classify = classify
+        self.droppable = frozenset(droppable)
+        self.dropped = 0
+
+        self._items: Deque = deque()
+        self._not_full = threading.Condition(threading.Lock())
+
+    def put(self, item) -> bool:
+        """
+        Add an item at the end of the queue.
+
+        :return: False if the item itself was dropped.
+        :rtype: bool
+        """
+        with self._not_full:
+            if len(self._items) >= self.max_size and not self.__make_room(item):
+                self.dropped += 1
+                return False
+            self._items.append(item)
+            return True
+
+    def __make_room(self, item) -> bool:
+        """
+        Called with the lock held when the queue is full.
+
+        :return: False if the incoming item should be dropped instead.
+        """
+        if self.policy == OverflowPolicy.DROP_OLDEST:
+            self._items.popleft()
+            self.dropped += 1
+            return True
+        if self.policy == OverflowPolicy.DROP_BY_TYPE:
+            if self.classify(item) in self.droppable:
+                return False
+            for index, queued in enumerate(self._items):
+                if self.classify(queued) in self.droppable:
+                    del self._items[index]
+                    self.dropped += 1
+                    return True
+        while len(self._items) >= self.max_size:
+            self._not_full.wait()
+        return True
+
+    def drain(self, max_items: Optional[int] = None) -> List:
+        """
+        Remove and return the items at the head of the queue, in order.
+
+        :param max_items: Batch size; None means everything that is queued.
+
+        :return: The removed items.
+        :rtype: list
+        """
+        with self._not_full:
+            if max_items is None or max_items >= len(self._items):
+                batch = list(self._items)
+                self._items.clear()
+            else:
+                batch = [self._items.popleft() for _ in range(max_items)]
+            self._not_full.notify_all()
+        return batch
+
+    def clear(self) -> None:
+        with self._not_full:
+            self._items.clear()
+            self._not_full.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -1,6 +1,8 @@
-from typing import List
+import threading
+from typing import Callable, List, Optional
 
 from src.Packet import Packet
+from src.tools.Dialer import LinkDown
 from src.tools.parsers import parse_ip
 from src.tools.simpletcp.clientsocket import ClientSocket
 from src.tools.type_repo import Address
@@ -8,7 +10,9 @@ from tools.logger import log
 
 
 class Node:
-    def __init__(self, server_address: Address, set_register: bool = False) -> None:
+    def __init__(self, server_address: Address, set_register: bool = False,
+                 client_factory: Callable[[str, int], ClientSocket] = None, window: int = 1,
+                 timeout: Optional[float] = None) -> None:
         """
         The Node object constructor.
 
@@ -21,6 +25,9 @@ class Node:
 
         :param server_address:
         :param set_register:
+        :param client_factory: Makes the client connection from (ip, port); A blocking ClientSocket if not given.
+        :param window: Maximum number of packets sent and not ACKed yet; 1 means stop-and-wait.
+        :param timeout: Deadline in seconds for connecting and for every send/receive; None blocks forever.
         """
         self.server_ip = parse_ip(server_address[0])
         self.server_port = server_address[1]
@@ -29,24 +36,102 @@ class Node:
 
         self.out_buff: List[Packet] = []
         self.is_register = set_register
+        self.client_factory = client_factory
+        self.window = window
+        self.timeout = timeout
+        self.__ack_remainder = b''
+        self.__out_buff_lock = threading.Lock()
+        # Held by the writer that is sending our out_buff, so a Node is never written by two threads at once.
+        self.writer_lock = threading.Lock()
         self.__initialize_client_socket()
 
     def __initialize_client_socket(self):
         formatted_ip = ".".join(str(int(part)) for part in self.server_ip.split("."))
-        self.client = ClientSocket(formatted_ip, self.server_port, single_use=False)
+        if self.client_factory:
+            self.client = self.client_factory(formatted_ip, self.server_port)
+        else:
+            self.client = ClientSocket(formatted_ip, self.server_port, single_use=False, timeout=self.timeout)
 
     def send_message(self) -> None:
         """
         Final function to send buffer to the client's socket.
 
+        Packets added while we are sending stay in out_buff for the next call.
+
         :return:
         """
-        for packet in self.out_buff:
-            response = self.client.send(packet.get_buf())
+        with self.__out_buff_lock:
+            packets, self.out_buff = self.out_buff, []
+        if self.window > 1:
+            self.__send_pipelined(packets)
+            return
+        for index, packet in enumerate(packets):
+            try:
+                response = self.client.send(packet.get_buf())
+            except LinkDown:
+                self.__requeue(packets[index:])
+                raise
             if response != b'ACK':
                 log(f"Node({self.get_server_address()}): Message of type {packet.get_type()} not ACKed.")
 
-        self.out_buff.clear()
+    def __requeue(self, packets: List[Packet]) -> None:
+        """
+        Put packets that could not be delivered back at the head of out_buff.
+        """
+        with self.__out_buff_lock:
+            self.out_buff[:0] = packets
+
+    def has_messages(self) -> bool:
+        """
+
+        :return: Whether there is anything in out_buff to send.
+        :rtype: bool
+        """
+        return len(self.out_buff) > 0
+
+    def __send_pipelined(self, packets: List[Packet]) -> None:
+        """
+        Keep up to 'window' packets in flight and count ACKs as they come back; The server batches the ACKs of
+        the packets it read together, so a burst costs one round trip instead of one per packet.
+        Packets that fit in the window are written with a single call.
+
+        :return:
+        """
+        sent, in_flight = 0, 0
+        try:
+            while sent < len(packets):
+                if in_flight == self.window:
+                    in_flight -= self.__receive_acks()
+                # Coalesce everything the window allows into one scatter-gather write.
+                batch = packets[sent:sent + self.window - in_flight]
+                self.client.send_buffers([packet.get_buf() for packet in batch])
+                sent += len(batch)
+                in_flight += len(batch)
+            while in_flight > 0:
+                in_flight -= self.__receive_acks()
+        except LinkDown:
+            # The connection will be a new one; Send everything that was not ACKed again on it.
+            self.__ack_remainder = b''
+            self.__requeue(packets[sent - in_flight:])
+            raise
+
+    def __receive_acks(self) -> int:
+        """
+        Wait for the next ACKs from the server.
+
+        :return: Number of ACKs received.
+        :rtype: int
+        """
+        response = self.client.receive()
+        if not response:
+            raise ConnectionError(f"Node({self.get_server_address()}): Connection closed before ACK.")
+        # An ACK may be split between two reads.
+        acks = self.__ack_remainder + response
+        n_acks = len(acks) // 3
+        self.__ack_remainder = acks[3 * n_acks:]
+        if acks[:3 * n_acks] != b'ACK' * n_acks:
+            log(f"Node({self.get_server_address()}): Unexpected response {acks}.")
+        return n_acks
 
     def add_message_to_out_buff(self, message: Packet) -> None:
         """
@@ -55,7 +140,8 @@ class Node:
         :param message: The message we want to add to out_buff
         :return:
         """
-        self.out_buff.append(message)
+        with self.__out_buff_lock:
+            self.out_buff.append(message)
 
     def close(self) -> None:
         """
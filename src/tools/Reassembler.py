@@ -0,0 +1,117 @@
+import bisect
+import time
+from typing import Dict, Hashable, List, Optional
+
+
+class _PartialMessage:
+    def __init__(self, total: int):
+        self.total = total
+        self.received = 0
+        self.last_update = time.time()
+        # Sorted offsets of the fragments that arrived, and the data of each of them.
+        self.offsets: List[int] = []
+        self.chunks: Dict[int, bytes] = {}
+
+    def add(self, offset: int, chunk) -> Optional[bool]:
+        """
+        Keep a copy of the fragment that starts at offset.
+
+        :return: True if it is new, False if it arrived before, None if it overlaps another fragment.
+        """
+        end = offset + len(chunk)
+        previous = self.chunks.get(offset)
+        if previous is not None and len(previous) == len(chunk):
+            return False
+        index = bisect.bisect(self.offsets, offset)
+        if (index > 0 and self.offsets[index - 1] + len(self.chunks[self.offsets[index - 1]]) > offset) or \
+                (index < len(self.offsets) and self.offsets[index] < end):
+            return None
+        self.offsets.insert(index, offset)
+        self.chunks[offset] = bytes(chunk)
+        self.received += len(chunk)
+        return True
+
+    def join(self) -> bytes:
+        return b''.join(self.chunks[offset] for offset in self.offsets)
+
+
+class Reassembler:
+    def __init__(self, max_message_size: int, timeout: float, max_buffered: int, max_messages: int):
+        """
+        Puts fragmented messages together as their fragments arrive; Only the fragments that arrived are kept (not a
+        buffer of the announced size, which the sender may lie about), and joined once the message is complete.
+
+        Fragments that arrive again (e.g. resent after a reconnect) are ignored; A message whose fragments disagree
+        on its size, or overlap, is dropped.
+
+        :param max_message_size: Messages bigger than this (bytes) are dropped.
+        :param timeout: A message that got no fragment for this many seconds is dropped.
+        :param max_buffered: Bytes kept of all incomplete messages together; Beyond it the messages that got no
+                             fragment for the longest time are dropped.
+        :param max_messages: Incomplete messages kept; Beyond it the same as max_buffered.
+        """
+        self.max_message_size = max_message_size
+        self.timeout = timeout
+        self.max_buffered = max_buffered
+        self.max_messages = max_messages
+        self.buffered = 0
+        # Ordered by last update; The least recently updated message comes first.
+        self._messages: Dict[Hashable, _PartialMessage] = {}
+
+    def add(self, key: Hashable, offset: int, total: int, chunk) -> Optional[bytes]:
+        """
+        Add a fragment.
+
+        :param key: Identifies the message.
+        :param offset: Where the fragment starts in the message.
+        :param total: Size of the whole message.
+        :param chunk: The fragment data; Any bytes-like object.
+
+        :return: The whole message if this was its last fragment, otherwise None.
+        :rtype: bytes
+        """
+        self.__drop_stale()
+        if total > self.max_message_size or offset + len(chunk) > total:
+            self.__drop(key)
+            return None
+        if not chunk:
+            return None
+        message = self._messages.pop(key, None)
+        if message is None:
+            message = _PartialMessage(total)
+        elif message.total != total:
+            self.buffered -= message.received
+            return None
+        is_new = message.add(offset, chunk)
+        if is_new is None:
+            self.buffered -= message.received
+            return None
+        message.last_update = time.time()
+        if is_new:
+            self.buffered += len(chunk)
+        if message.received < total:
+            self._messages[key] = message
+            self.__evict()
+            return None
+        self.buffered -= message.received
+        return message.join()
+
+    def __drop(self, key: Hashable) -> None:
+        message = self._messages.pop(key, None)
+        if message is not None:
+            self.buffered -= message.received
+
+    def __drop_stale(self) -> None:
+        deadline = time.time() - self.timeout
+        while self._messages:
+            key, message = next(iter(self._messages.items()))
+            if message.last_update >= deadline:
+                return
+            self.__drop(key)
+
+    def __evict(self) -> None:
+        while len(self._messages) > self.max_messages or self.buffered > self.max_buffered:
+            self.__drop(next(iter(self._messages)))
+
+    def __len__(self) -> int:
+        return len(self._messages)
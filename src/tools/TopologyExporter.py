@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, Optional
+
+from tools.logger import log
+
+
+class ExportFormat(Enum):
+    JSON = 'JSON'
+    DOT = 'DOT'
+
+
+def format_address(address) -> str:
+    return f'{address[0]}:{address[1]}'
+
+
+def render_json(snapshot: Dict) -> str:
+    return json.dumps(snapshot, separators=(',', ':'))
+
+
+def render_dot(snapshot: Dict) -> str:
+    lines = ['digraph network {']
+    for node in snapshot['nodes']:
+        address = format_address(node['address'])
+        if not node['alive']:
+            lines.append(f'  "{address}" [style=dashed];')
+        if node['parent'] is not None:
+            lines.append(f'  "{format_address(node["parent"])}" -> "{address}";')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+RENDERERS = {ExportFormat.JSON: render_json, ExportFormat.DOT: render_dot}
+
+
+class TopologyExporter:
+    def __init__(self, snapshot: Callable[[], Dict], path: str, export_format: Optional[ExportFormat] = None,
+                 min_interval: float = 5):
+        """
+        Writes snapshots of the network topology to a file on its own thread, so whoever changes the graph only
+        calls notify and never waits for it.
+
+        Changes are coalesced: At most one snapshot is written every min_interval seconds, and the file is replaced
+        atomically, so readers never see half of one.
+
+        :param snapshot: Returns the topology; e.g. NetworkGraph.snapshot.
+        :param path: The file to write.
+        :param export_format: JSON or DOT (Graphviz); By default DOT if path ends with '.dot', otherwise JSON.
+        :param min_interval: Minimum seconds between two snapshots.
+        """
+        self.snapshot = snapshot
+        self.path = path
+        if export_format is None:
+            export_format = ExportFormat.DOT if path.endswith('.dot') else ExportFormat.JSON
+        self.export_format = export_format
+        self.min_interval = min_interval
+        self.exports = 0
+
+        self._changed = threading.Event()
+        self._stopped = False
+        self._last_export = 0
+        self._thread = threading.Thread(target=self.__run, name='TopologyExporter', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def notify(self) -> None:
+        """
+        The topology has changed; Returns at once.
+        """
+        self._changed.set()
+
+    def stop(self) -> None:
+        """
+        Stop the thread; The current topology is written before it stops.
+        """
+        self._stopped = True
+        self._changed.set()
+        self._thread.join()
+
+    def export(self) -> None:
+        """
+        Write a snapshot now, on the calling thread.
+        """
+        text = RENDERERS[self.export_format](self.snapshot())
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(text)
+        os.replace(temporary_path, self.path)
+        self.exports += 1
+
+    def __run(self) -> None:
+        while True:
+            self._changed.wait()
+            delay = self._last_export + self.min_interval - time.time()
+            if delay > 0 and not self._stopped:
+                time.sleep(delay)
+            self._changed.clear()
+            self._last_export = time.time()
+            try:
+                self.export()
+            except OSError as e:
+                log(f'Cannot export the network topology: {e}')
+            if self._stopped:
+                return
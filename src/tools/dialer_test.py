@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+
+from src.Packet import PacketFactory
+from src.tools.Dialer import Dialer, LinkDown
+from src.tools.Node import Node
+
+SOURCE = ('127.0.0.1', 5000)
+
+
+class FakeClient:
+    def __init__(self, ip: str, port: int):
+        self.closed = False
+
+    def send(self, data):
+        return b'ACK'
+
+    def close(self):
+        self.closed = True
+
+
+class FlakyFactory:
+    """
+    Fails the first 'failures' connects.
+    """
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, ip: str, port: int):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionRefusedError
+        return FakeClient(ip, port)
+
+
+def test_unexpected_factory_error_fails_the_connection():
+    ready = threading.Event()
+
+    def client_factory(ip, port):
+        raise OverflowError('port must be 0-65535.')
+
+    connection = Dialer(client_factory, ready.set).dial('127.0.0.1', 70000)
+    assert ready.wait(5)
+    assert connection.is_ready() and connection.has_failed()
+    with pytest.raises(ConnectionError) as error:
+        connection.send(b'')
+    assert not isinstance(error.value, LinkDown)
+    assert isinstance(error.value.__cause__, OverflowError)
+
+
+def test_backoff_doubles_up_to_max_delay():
+    dialer = Dialer(FakeClient, base_delay=1, max_delay=8)
+    for failures, delay in [(1, 1), (2, 2), (3, 4), (4, 8), (10, 8)]:
+        for _ in range(20):
+            assert delay / 2 <= dialer.backoff(failures) <= delay
+
+
+def test_retries_until_connected():
+    ready = threading.Event()
+    factory = FlakyFactory(2)
+    connection = Dialer(factory, ready.set, max_attempts=3, base_delay=0.01).dial('127.0.0.1', 5000)
+    with pytest.raises(LinkDown):
+        connection.send(b'')
+    assert ready.wait(5)
+    assert factory.calls == 3 and not connection.has_failed()
+    assert connection.send(b'') == b'ACK'
+
+
+def test_gives_up_after_max_attempts():
+    ready = threading.Event()
+    factory = FlakyFactory(10)
+    dialer = Dialer(factory, ready.set, max_attempts=2, base_delay=0.01)
+    connection = dialer.dial('127.0.0.1', 5000)
+    assert ready.wait(5)
+    assert factory.calls == 3 and connection.has_failed()
+    # A failed connection is not reused.
+    dialer.client_factory = FakeClient
+    assert dialer.dial('127.0.0.1', 5000) is not connection
+
+
+def test_connection_is_shared_until_its_last_user_closes_it():
+    dialer = Dialer(FakeClient)
+    connection = dialer.dial('127.0.0.1', 5000)
+    assert dialer.dial('127.0.0.1', 5000) is connection
+    assert dialer.dial('127.0.0.1', 5001) is not connection
+    connection._ready.wait(5)
+    client = connection._client
+    connection.close()
+    assert not client.closed and dialer.dial('127.0.0.1', 5000) is connection
+    connection.close()
+    connection.close()
+    assert client.closed and dialer.dial('127.0.0.1', 5000) is not connection
+
+
+class DownClient(FakeClient):
+    """
+    Delivers 'delivered' packets, then the link goes down.
+    """
+    def __init__(self, delivered: int):
+        super().__init__('127.0.0.1', 5000)
+        self.delivered = delivered
+        self.sent = []
+
+    def send(self, data):
+        return self.__deliver(data, b'ACK')
+
+    def send_buffers(self, buffers):
+        for buffer in buffers:
+            self.__deliver(buffer, None)
+
+    def receive(self):
+        return b'ACK' * len(self.sent)
+
+    def __deliver(self, data, response):
+        if len(self.sent) == self.delivered:
+            raise LinkDown('Down.')
+        self.sent.append(data)
+        return response
+
+
+@pytest.mark.parametrize('window', [1, 4])
+def test_node_keeps_the_packets_that_were_not_sent_on_link_down(window):
+    client = DownClient(2)
+    node = Node(SOURCE, client_factory=lambda ip, port: client, window=window)
+    packets = [PacketFactory.new_message_packet(str(index), SOURCE) for index in range(5)]
+    for packet in packets:
+        node.add_message_to_out_buff(packet)
+    with pytest.raises(LinkDown):
+        node.send_message()
+    # Stop-and-wait knows the first two were ACKed; With a window, nothing was.
+    assert node.out_buff == (packets[2:] if window == 1 else packets)
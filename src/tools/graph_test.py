@@ -1,4 +1,142 @@
-from src.tools.Graph import GraphNode, NetworkGraph
+import random
+
+from src.tools import Graph
+from src.tools.Graph import GraphNode, NetworkGraph, check_is_parent
+from src.tools.parsers import parse_ip
+
+ROOT_ADDRESS = (parse_ip('0.0.0.0'), 8080)
+
+
+def depth(network_graph: NetworkGraph, node: GraphNode) -> int:
+    result = 0
+    while node is not network_graph.root:
+        node = node.parent
+        result += 1
+    return result
+
+
+def candidates(network_graph: NetworkGraph, sender):
+    """
+    The nodes find_live_node may pick for sender, by a BFS from the root; As it was done before the free slot heap.
+    """
+    sender_node = network_graph.find_node(sender)
+    result = []
+    queue = [network_graph.root]
+    while queue:
+        node = queue.pop(0)
+        queue.extend(node.children)
+        if node.level == 8 or len(node.children) >= 2 or not node.is_alive \
+                or node.address == sender or (sender_node and check_is_parent(node, sender_node)):
+            continue
+        result.append(node)
+    return result
+
+
+def test_moved_subtree_is_leveled_again():
+    network_graph = NetworkGraph(GraphNode(ROOT_ADDRESS))
+    network_graph.add_node('0.0.0.1', 8080, ROOT_ADDRESS)
+    network_graph.add_node('0.0.0.2', 8080, (parse_ip('0.0.0.1'), 8080))
+    network_graph.add_node('0.0.0.3', 8080, (parse_ip('0.0.0.2'), 8080))
+    # 2 joins the root again, with 3 under it.
+    network_graph.add_node('0.0.0.2', 8080, ROOT_ADDRESS)
+    assert network_graph.find_node((parse_ip('0.0.0.2'), 8080)).level == 1
+    assert network_graph.find_node((parse_ip('0.0.0.3'), 8080)).level == 2
+
+
+def test_find_live_node_picks_as_deep_as_bfs():
+    random.seed(1)
+    addresses = [(f'10.0.0.{i}', 8080) for i in range(60)]
+    for _ in range(40):
+        network_graph = NetworkGraph(GraphNode(ROOT_ADDRESS))
+        for _ in range(300):
+            ip, port = random.choice(addresses)
+            address = (parse_ip(ip), port)
+            node = network_graph.find_node(address)
+            operation = random.random()
+            if operation < 0.6:
+                father_address = network_graph.find_live_node(address)
+                expected = candidates(network_graph, address)
+                if father_address is None:
+                    assert not expected
+                    continue
+                father = network_graph.find_node(father_address)
+                assert father in expected
+                assert depth(network_graph, father) == max(depth(network_graph, other) for other in expected)
+                network_graph.add_node(ip, port, father_address)
+            elif operation < 0.8 and node and node.parent and node in node.parent.children:
+                network_graph.remove_node(address)
+            elif node:
+                network_graph.keep_alive(address)
+        for node in network_graph.snapshot()['nodes'][1:]:
+            assert node['level'] == depth(network_graph, network_graph.find_node(node['address']))
+
+
+def connected_nodes(network_graph: NetworkGraph):
+    nodes = [network_graph.root]
+    for node in nodes:
+        nodes.extend(node.children)
+    return nodes
+
+
+def test_is_in_subtree_after_moves_and_removals():
+    network_graph = NetworkGraph(GraphNode(ROOT_ADDRESS))
+    addresses = [(parse_ip(f'0.0.0.{i}'), 8080) for i in range(1, 4)]
+    network_graph.add_node('0.0.0.1', 8080, ROOT_ADDRESS)
+    network_graph.add_node('0.0.0.2', 8080, addresses[0])
+    network_graph.add_node('0.0.0.3', 8080, addresses[1])
+    one, two, three = (network_graph.find_node(address) for address in addresses)
+    assert network_graph.is_in_subtree(three, one) and not network_graph.is_in_subtree(one, three)
+    assert not network_graph.is_in_subtree(one, one)
+    # 2 moves to the root, with 3 under it.
+    network_graph.add_node('0.0.0.2', 8080, ROOT_ADDRESS)
+    assert not network_graph.is_in_subtree(three, one) and network_graph.is_in_subtree(three, two)
+    # A removed sub-tree is not connected to the root anymore.
+    network_graph.remove_node(addresses[1])
+    assert not network_graph.is_in_subtree(three, two)
+    assert not network_graph.is_in_subtree(three, network_graph.root)
+
+
+def test_is_in_subtree_matches_check_is_parent():
+    random.seed(7)
+    addresses = [(f'10.0.0.{i}', 8080) for i in range(40)]
+    for _ in range(20):
+        network_graph = NetworkGraph(GraphNode(ROOT_ADDRESS))
+        for _ in range(300):
+            ip, port = random.choice(addresses)
+            address = (parse_ip(ip), port)
+            node = network_graph.find_node(address)
+            operation = random.random()
+            if operation < 0.6:
+                father_address = network_graph.find_live_node(address)
+                if father_address:
+                    network_graph.add_node(ip, port, father_address)
+            elif operation < 0.8 and node and node.parent and node in node.parent.children:
+                network_graph.remove_node(address)
+            elif node:
+                network_graph.keep_alive(address)
+            for _ in range(10):
+                node, ancestor = random.choice(connected_nodes(network_graph)), random.choice(network_graph.nodes)
+                assert network_graph.is_in_subtree(node, ancestor) == check_is_parent(node, ancestor)
+
+
+def test_pop_expired_nodes_by_last_hello(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(Graph.time, 'time', lambda: clock[0])
+    network_graph = NetworkGraph(GraphNode(ROOT_ADDRESS))
+    addresses = [(parse_ip(f'0.0.0.{i}'), 8080) for i in range(1, 5)]
+    for index, (ip, port) in enumerate(addresses):
+        clock[0] = index
+        network_graph.add_node(ip, port, ROOT_ADDRESS if index < 2 else addresses[0])
+    clock[0] = 5
+    network_graph.keep_alive(addresses[0])
+    network_graph.remove_node(addresses[1])
+    clock[0] = 10
+    # 1 said hello at 5, 2 is removed, and 3 and 4 are expired, oldest first.
+    assert [node.address for node in network_graph.pop_expired_nodes(6)] == addresses[2:]
+    assert network_graph.pop_expired_nodes(6) == []
+    clock[0] = 20
+    assert [node.address for node in network_graph.pop_expired_nodes(6)] == addresses[:1]
+
 
 if __name__ == '__main__':
     root = GraphNode(('0', 8080))
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from src.tools.IngressQueue import IngressQueue, OverflowPolicy
+
+
+def test_drain_in_batches():
+    queue = IngressQueue(10)
+    for item in range(5):
+        assert queue.put(item)
+    assert queue.drain(2) == [0, 1]
+    assert queue.drain(10) == [2, 3, 4]
+    assert queue.drain() == []
+
+
+def test_drop_oldest():
+    queue = IngressQueue(3, OverflowPolicy.DROP_OLDEST)
+    for item in range(5):
+        assert queue.put(item)
+    assert queue.drain() == [2, 3, 4]
+    assert queue.dropped == 2
+
+
+def test_drop_by_type():
+    queue = IngressQueue(3, OverflowPolicy.DROP_BY_TYPE, classify=lambda item: item[0], droppable={'message'})
+    queue.put(('message', 1))
+    queue.put(('join', 2))
+    queue.put(('message', 3))
+    # A droppable item arriving at a full queue is dropped itself.
+    assert not queue.put(('message', 4))
+    # Any other item takes the place of the oldest droppable one.
+    assert queue.put(('reunion', 5))
+    assert queue.drain() == [('join', 2), ('message', 3), ('reunion', 5)]
+    assert queue.dropped == 2
+
+
+def test_drop_by_type_needs_classify():
+    with pytest.raises(ValueError):
+        IngressQueue(3, OverflowPolicy.DROP_BY_TYPE)
+
+
+def test_block_waits_for_room():
+    queue = IngressQueue(2)
+    queue.put(0)
+    queue.put(1)
+    producer = threading.Thread(target=queue.put, args=(2,))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+    assert queue.drain(1) == [0]
+    producer.join(5)
+    assert not producer.is_alive()
+    assert queue.drain() == [1, 2]
+    assert queue.dropped == 0
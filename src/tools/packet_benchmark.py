@@ -0,0 +1,166 @@
+"""
+    Microbenchmarks of the packet codec (Packet, PacketFactory and parsers).
+
+    Usage:
+        python -m src.tools.packet_benchmark [--number N] [--repeat R] [--output results.json] [--compare old.json]
+
+    For every case it reports:
+        ops/sec:        Best of 'repeat' runs of 'number' operations.
+        peak B/op:      Mean peak of memory allocated while running one operation (tracemalloc), including
+                        temporaries.
+        blocks/op:      Mean number of memory blocks an operation allocated and did not free; i.e. the objects it
+                        made and returned. Temporaries are freed before the operation returns, so they only show in
+                        the peak; Python does not count them.
+    Both are measured over ALLOCATION_CALLS calls, after WARMUP calls that fill the caches and free lists.
+    --output saves the results as JSON, and --compare prints the speedup against such a file of an earlier run.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List
+
+from src.Packet import VERSION, VERSION_2, PacketFactory, ReunionType
+from src.tools.parsers import parse_ip, parse_port
+
+SOURCE = ('192.168.1.10', 5335)
+MESSAGE = 'Hello World! ' * 8
+PATH_LENGTHS = range(1, 9)
+# Packets in a batch of parse_buffers.
+BATCH_SIZE = 256
+# Calls of an operation before its allocations are measured, and calls that are measured.
+WARMUP = 100
+ALLOCATION_CALLS = 1000
+
+
+def path_of(length: int):
+    return [(f'10.0.{i}.1', 5000 + i) for i in range(length)]
+
+
+def fresh(make: Callable, use: Callable, count: int) -> Callable:
+    """
+    An operation on objects that are made before timing starts, so the caches of a Packet don't hide the cost
+    of its first use.
+
+    :param make: Makes one object.
+    :param use: The operation on one object.
+    :param count: Number of objects to make; At least the number of times the operation runs.
+    """
+    objects = iter([make() for _ in range(count)])
+    return lambda: use(next(objects))
+
+
+def cases(number: int) -> Dict[str, Callable[[], Callable]]:
+    """
+    :return: Benchmark name -> a function that prepares the operation (called once per run).
+    """
+    count = max(number, WARMUP + ALLOCATION_CALLS)
+    benchmarks = {}
+    for version in (VERSION, VERSION_2):
+        message_buf = PacketFactory.new_message_packet(MESSAGE, SOURCE, version).get_buf()
+        reunion_buf = PacketFactory.new_reunion_packet(ReunionType.REQ, SOURCE, path_of(8), version).get_buf()
+        benchmarks.update({
+            f'v{version} parse_buffer message': lambda buf=message_buf: lambda: PacketFactory.parse_buffer(buf),
+            f'v{version} parse_buffer reunion(8)': lambda buf=reunion_buf: lambda: PacketFactory.parse_buffer(buf),
+            f'v{version} parse_buffers({BATCH_SIZE})': lambda bufs=[message_buf, reunion_buf] * (BATCH_SIZE // 2):
+            lambda: PacketFactory.parse_buffers(bufs),
+            f'v{version} get_buf message': lambda v=version: fresh(
+                lambda: PacketFactory.new_message_packet(MESSAGE, SOURCE, v), lambda p: p.get_buf(), count),
+            f'v{version} get_buf cached': lambda v=version: PacketFactory.new_message_packet(MESSAGE, SOURCE,
+                                                                                             v).get_buf,
+            f'v{version} get_addresses(8)': lambda buf=reunion_buf: fresh(
+                lambda: PacketFactory.parse_buffer(buf), lambda p: p.get_addresses(), count),
+            f'v{version} get_addresses_in_reverse(8)': lambda buf=reunion_buf: fresh(
+                lambda: PacketFactory.parse_buffer(buf), lambda p: p.get_addresses_in_reverse(), count),
+        })
+        for length in PATH_LENGTHS:
+            benchmarks[f'v{version} new_reunion_packet({length})'] = lambda path=path_of(length), v=version: \
+                lambda: PacketFactory.new_reunion_packet(ReunionType.REQ, SOURCE, path, v).get_buf()
+    benchmarks['parse_ip'] = lambda: lambda: parse_ip('192.168.1.10')
+    benchmarks['parse_port'] = lambda: lambda: parse_port(5335)
+    return benchmarks
+
+
+def ops_per_second(prepare: Callable, number: int, repeat: int) -> float:
+    best = min(timeit.timeit(prepare(), number=number) for _ in range(repeat))
+    return number / best
+
+
+def allocations(prepare: Callable) -> Dict[str, float]:
+    """
+    :return: Mean peak bytes of one operation, and mean blocks it keeps; Over warmed up calls.
+    """
+    operation = prepare()
+    for _ in range(WARMUP):
+        operation()
+    # Made before tracing, so the bookkeeping doesn't allocate between the snapshots.
+    results: List = [None] * ALLOCATION_CALLS
+    peaks: List[int] = [0] * ALLOCATION_CALLS
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for index in range(ALLOCATION_CALLS):
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            results[index] = operation()
+            peaks[index] = tracemalloc.get_traced_memory()[1] - start
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    # Only what the operation allocated; Not the snapshots, nor the ints of this loop.
+    ignored = (tracemalloc.__file__, __file__)
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                 if stat.traceback[0].filename not in ignored)
+    return {'peak_bytes_per_op': sum(peaks) / ALLOCATION_CALLS, 'blocks_per_op': blocks / ALLOCATION_CALLS}
+
+
+def run(number: int, repeat: int) -> Dict:
+    results = {}
+    for name, prepare in cases(number).items():
+        results[name] = {'ops_per_sec': ops_per_second(prepare, number, repeat), **allocations(prepare)}
+    return {
+        'python': sys.version,
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'number': number,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def report(run_results: Dict, baseline: Dict = None) -> None:
+    print(f"{'benchmark':<36} {'ops/sec':>12} {'peak B/op':>10} {'blocks/op':>10}" + ('  speedup' if baseline else ''))
+    for name, result in run_results['results'].items():
+        line = f"{name:<36} {result['ops_per_sec']:>12,.0f} {result['peak_bytes_per_op']:>10.0f} " \
+               f"{result['blocks_per_op']:>10.1f}"
+        if baseline and name in baseline['results']:
+            line += f"  {result['ops_per_sec'] / baseline['results'][name]['ops_per_sec']:>6.2f}x"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packet codec microbenchmarks.')
+    parser.add_argument('--number', type=int, default=10000, help='Operations per timing run.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs; The best one is reported.')
+    parser.add_argument('--output', help='Save the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    run_results = run(args.number, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    report(run_results, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(run_results, file, indent=2)
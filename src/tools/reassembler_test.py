@@ -0,0 +1,63 @@
+from src.tools.Reassembler import Reassembler
+
+
+def test_fragments_in_any_order():
+    reassembler = Reassembler(1024, 60, 4096, 16)
+    assert reassembler.add('m', 4, 8, b'efgh') is None
+    assert reassembler.add('m', 0, 8, b'abcd') == b'abcdefgh'
+    assert len(reassembler) == 0
+
+
+def test_duplicate_fragment_is_ignored():
+    reassembler = Reassembler(1024, 60, 4096, 16)
+    assert reassembler.add('m', 0, 8, b'abcd') is None
+    # Delivered again, e.g. after a reconnect; It must not complete the message with a hole.
+    assert reassembler.add('m', 0, 8, b'abcd') is None
+    assert len(reassembler) == 1
+    assert reassembler.add('m', 4, 8, b'efgh') == b'abcdefgh'
+
+
+def test_fragment_with_another_total_drops_the_message():
+    reassembler = Reassembler(1024, 60, 4096, 16)
+    assert reassembler.add('m', 0, 8, b'abcd') is None
+    assert reassembler.add('m', 4, 16, b'efgh') is None
+    assert len(reassembler) == 0
+    # The rest of the first message can't complete it anymore.
+    assert reassembler.add('m', 4, 8, b'efgh') is None
+
+
+def test_overlapping_fragment_drops_the_message():
+    reassembler = Reassembler(1024, 60, 4096, 16)
+    assert reassembler.add('m', 0, 8, b'abcd') is None
+    assert reassembler.add('m', 2, 8, b'cdef') is None
+    assert len(reassembler) == 0
+
+
+def test_buffer_grows_with_the_fragments():
+    reassembler = Reassembler(1024, 60, 4096, 16)
+    # Announces the biggest message, but only what arrived is kept.
+    assert reassembler.add('m', 0, 1024, b'abcd') is None
+    assert reassembler.buffered == 4
+
+
+def test_too_many_messages_evict_the_least_recently_updated():
+    reassembler = Reassembler(1024, 60, 4096, 2)
+    assert reassembler.add('a', 0, 12, b'abcd') is None
+    assert reassembler.add('b', 0, 12, b'abcd') is None
+    assert reassembler.add('a', 4, 12, b'efgh') is None
+    # One message too many; b got no fragment for the longest time.
+    assert reassembler.add('c', 0, 12, b'abcd') is None
+    assert len(reassembler) == 2
+    assert reassembler.add('a', 8, 12, b'ijkl') == b'abcdefghijkl'
+    assert reassembler.add('b', 4, 12, b'efghijkl') is None
+
+
+def test_too_many_bytes_evict_the_least_recently_updated():
+    reassembler = Reassembler(1024, 60, 10, 16)
+    assert reassembler.add('a', 0, 12, b'abcd') is None
+    assert reassembler.add('b', 0, 12, b'abcd') is None
+    assert reassembler.add('a', 4, 12, b'efgh') is None
+    assert len(reassembler) == 1
+    assert reassembler.buffered == 8
+    assert reassembler.add('a', 8, 12, b'ijkl') == b'abcdefghijkl'
+    assert reassembler.buffered == 0
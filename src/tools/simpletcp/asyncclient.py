@@ -0,0 +1,96 @@
+import asyncio
+import concurrent.futures
+import socket
+import sys
+
+
+class AsyncClientSocket:
+    def __init__(self, mode, port, loop, received_bytes=2048, timeout=None):
+        """
+
+        A persistent client connection driven by an asyncio event loop running in another thread.
+        It offers the same blocking API as a non single-use ClientSocket, but all socket I/O happens on 'loop',
+        so many connections share one thread instead of blocking their own.
+
+        mode and timeout are interpreted exactly like in ClientSocket; An expired timeout raises socket.timeout.
+        """
+        if mode == "localhost":
+            self.connect_ip = mode
+        elif mode == "public":
+            self.connect_ip = socket.gethostname()
+        else:
+            self.connect_ip = mode
+        self.connect_port = port
+        if type(self.connect_port) != int:
+            print("port must be an integer", file=sys.stderr)
+            raise ValueError
+        self.loop = loop
+        self.received_bytes = received_bytes
+        self.timeout = timeout
+        self._reader, self._writer = self._run(asyncio.open_connection(self.connect_ip, self.connect_port))
+        self.closed = False
+
+    def _run(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise socket.timeout(f"No progress in {self.timeout} seconds")
+
+    def get_port(self):
+        return self.connect_port
+
+    def get_ip(self):
+        return self.connect_ip
+
+    async def _exchange(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+        return await self._reader.read(self.received_bytes)
+
+    def send(self, data):
+        """
+
+        Send data (str or bytes) and return the response received from the server, like ClientSocket.send.
+        """
+        if type(data) == str:
+            data = bytes(data, "UTF-8")
+        if type(data) != bytes:
+            print("data must be a string or bytes", file=sys.stderr)
+            raise ValueError
+        return self._run(self._exchange(data))
+
+    async def _write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def sendall(self, data):
+        """
+
+        Send all of data (bytes) without waiting for a response, like ClientSocket.sendall.
+        """
+        self._run(self._write(data))
+
+    async def _write_buffers(self, buffers):
+        self._writer.writelines(buffers)
+        await self._writer.drain()
+
+    def send_buffers(self, buffers):
+        """
+
+        Send a list of buffers together, like ClientSocket.send_buffers; The transport handles partial writes.
+        """
+        self._run(self._write_buffers(buffers))
+
+    def receive(self):
+        """
+
+        Block until some response data arrives and return it, like ClientSocket.receive.
+        """
+        return self._run(self._reader.read(self.received_bytes))
+
+    def close(self):
+        if not self.closed:
+            self.loop.call_soon_threadsafe(self._writer.close)
+            self.closed = True
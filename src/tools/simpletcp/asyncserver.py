@@ -0,0 +1,118 @@
+import asyncio
+import queue
+import socket
+import sys
+
+from src.tools.simpletcp.framing import FrameBuffer
+from src.tools.simpletcp.responsequeue import ResponseQueue
+
+
+class AsyncTCPServer:
+    """
+     The asyncio counterpart of TCPServer.
+     Instead of a select loop in a dedicated thread, every connection is served by a coroutine running on an
+     asyncio event loop, so one thread can handle thousands of links.
+
+     mode, port and read_callback have exactly the same meaning as in TCPServer:
+     read_callback(address, queue, data) is called from the event loop for every chunk of data received,
+     and anything put in the queue is written back to the same connection, even later and from another thread.
+     measure_frame and max_frame_size work like in TCPServer: the callback gets one complete frame per call.
+    """
+
+    def __init__(self, mode, port, read_callback,
+                 maximum_connections=5, receive_bytes=2048, measure_frame=None, max_frame_size=None):
+        if mode == "localhost":
+            self.ip = mode
+        elif mode == "public":
+            self.ip = socket.gethostname()
+        else:
+            self.ip = mode
+        self.port = port
+        if type(self.port) != int:
+            print("port must be an int", file=sys.stderr)
+            raise ValueError
+        self.callback = read_callback
+        self._max_connections = maximum_connections
+        if type(self._max_connections) != int:
+            print("max_connections must be an int", file=sys.stderr)
+            raise ValueError
+        self.received_bytes = receive_bytes
+        self.measure_frame = measure_frame
+        self.max_frame_size = max_frame_size
+        self._server = None
+
+    async def start(self):
+        """
+        Bind the listening socket and start serving on the running event loop.
+        """
+        self._server = await asyncio.start_server(self._handle_connection, self.ip, self.port,
+                                                  backlog=self._max_connections)
+
+    def run(self):
+        """
+        Blocking entry point with the same shape as TCPServer.run; it owns a fresh event loop.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start())
+        loop.run_forever()
+
+    async def _write_responses(self, writer, responses, ready):
+        """
+        Runs next to _handle_connection and writes whatever is put in the connection's queue.
+        """
+        while True:
+            await ready.wait()
+            ready.clear()
+            while True:
+                try:
+                    writer.write(responses.get_nowait())
+                except queue.Empty:
+                    break
+            await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        client_ip = writer.get_extra_info('peername')
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def notify():
+            try:
+                on_loop = asyncio.get_running_loop() is loop
+            except RuntimeError:
+                on_loop = False
+            if on_loop:
+                ready.set()
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(ready.set)
+
+        responses = ResponseQueue(notify)
+        frame_buffer = FrameBuffer(self.measure_frame, max_frame_size=self.max_frame_size) if self.measure_frame \
+            else None
+        write_task = loop.create_task(self._write_responses(writer, responses, ready))
+        try:
+            while True:
+                try:
+                    data = await reader.read(self.received_bytes)
+                except ConnectionResetError:
+                    # Consider 'Connection reset by peer' the same as reading zero bytes
+                    data = None
+                if not data:
+                    break
+                if frame_buffer is None:
+                    self.callback(client_ip, responses, data)
+                else:
+                    try:
+                        frame_buffer.feed(data)
+                        for frame in frame_buffer.frames():
+                            self.callback(client_ip, responses, frame)
+                    except ValueError:
+                        # The peer announced a frame we are not willing to buffer.
+                        break
+                if write_task.done():
+                    # Writing failed, so the connection is broken.
+                    break
+        finally:
+            responses.closed = True
+            write_task.cancel()
+            writer.close()
@@ -1,9 +1,11 @@
 import socket
 import sys
 
+from src.tools.simpletcp.vectored import send_all
+
 
 class ClientSocket:
-    def __init__(self, mode, port, received_bytes=2048, single_use=True):
+    def __init__(self, mode, port, received_bytes=2048, single_use=True, timeout=None):
         """
 
         Handle the socket's mode.
@@ -12,6 +14,9 @@ class ClientSocket:
         localhost -> (127.0.0.1)
         public ->    (0.0.0.0)
         otherwise, mode is interpreted as an IP address.
+
+        timeout (seconds) bounds connecting and every send/receive; socket.timeout is raised when it expires.
+        None means block forever.
         """
 
         if mode == "localhost":
@@ -27,6 +32,7 @@ class ClientSocket:
             raise ValueError
         # Actually create an INET, STREAMing socket.socket.
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
         # Save the number of bytes to be read in response
         self.received_bytes = received_bytes
         # Save whether this socket is single-use or not.
@@ -85,7 +91,8 @@ class ClientSocket:
             print("data must be a string or bytes", file=sys.stderr)
             raise ValueError
         # Everything is setup, now we must send the data.
-        self._socket.send(data)
+        # send may write only a part of it, so keep sending until it's all out.
+        self._socket.sendall(data)
         # Keep track of the fact that we've sent data (or attempted to).
         self.used = True
         # Now read the response:
@@ -98,8 +105,48 @@ class ClientSocket:
         # Return the response
         return response
 
+    def sendall(self, data):
+        """
+
+        Send all of data (bytes) without waiting for a response.
+        Used to pipeline several requests on a persistent socket; read the responses later with receive.
+
+        """
+        if self.single_use:
+            print("Pipelining needs a persistent socket", file=sys.stderr)
+            raise RuntimeError
+        self._socket.sendall(data)
+        self.used = True
+
+    def send_buffers(self, buffers):
+        """
+
+        Like sendall, but for a list of buffers (bytes-like) that are written together with scatter-gather
+        system calls, resuming after partial writes; The buffers are not copied into one bytes object.
+
+        """
+        if self.single_use:
+            print("Pipelining needs a persistent socket", file=sys.stderr)
+            raise RuntimeError
+        send_all(self._socket, buffers)
+        self.used = True
+
+    def receive(self):
+        """
+
+        Block until some response data arrives and return it; b"" means the server closed the connection.
+
+        """
+        return self._socket.recv(self.received_bytes)
+
     def close(self):
         # If the connection isn't already closed, close it.
         if not self.closed:
+            try:
+                # Wake up a thread that is blocked reading from us.
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Not connected.
+                pass
             self._socket.close()
             self.closed = True
@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from src.Packet import PacketFactory
+from src.tools.simpletcp.clientsocket import ClientSocket
+from src.tools.simpletcp.duplexclient import DuplexClient
+from src.tools.simpletcp.responsequeue import ReplyClient, ResponseQueue
+from src.tools.simpletcp.tcpserver import TCPServer
+
+SOURCE = ('127.0.0.1', 5000)
+
+
+class ScriptedClient:
+    """
+    Its server sends the chunks of 'received', then closes the connection.
+    """
+    def __init__(self, received):
+        self.received = queue.Queue()
+        for chunk in received:
+            self.received.put(chunk)
+        self.sent = []
+
+    def receive(self):
+        return self.received.get()
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        self.received.put(b'')
+
+
+def test_duplex_client_splits_acks_from_frames():
+    frame = PacketFactory.new_message_packet('Hello', SOURCE).get_buf()
+    frames = []
+    # ACKs and a frame, cut anywhere; Then the server closes the connection.
+    client = DuplexClient(ScriptedClient([b'AC', b'K' + frame[:5], frame[5:] + b'ACKA', b'CK', b'']),
+                          PacketFactory.get_frame_size, lambda data: frames.append(bytes(data)), timeout=5)
+    assert client.send(b'first') == b'ACK'
+    acks = b''
+    while True:
+        received = client.receive()
+        if not received:
+            break
+        acks += received
+    assert acks == b'ACKACK'
+    assert frames == [frame]
+
+
+def test_reply_client_puts_on_the_current_response_queue():
+    notified = []
+    responses = ResponseQueue(lambda: notified.append(True))
+    client = ReplyClient(lambda: responses)
+    assert client.send('a') == b'ACK'
+    client.send_buffers([b'b', b'c'])
+    assert client.receive() == b'ACKACK'
+    assert [responses.get_nowait() for _ in range(2)] == [b'a', b'bc']
+    assert len(notified) == 2
+    # The other side reconnected.
+    responses = ResponseQueue()
+    client.sendall(b'd')
+    assert responses.get_nowait() == b'd'
+    responses.closed = True
+    with pytest.raises(ConnectionError):
+        client.send(b'e')
+
+
+def connect(port: int) -> ClientSocket:
+    # The server starts listening on its own thread.
+    deadline = time.time() + 5
+    while True:
+        try:
+            return ClientSocket('127.0.0.1', port, single_use=False, timeout=5)
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def test_server_sends_frames_back_on_the_client_connection():
+    connections = {}
+
+    def callback(address, responses, data):
+        responses.put(b'ACK')
+        connections[PacketFactory.get_frame_source(data)] = responses
+
+    server = TCPServer('127.0.0.1', 0, callback, measure_frame=PacketFactory.get_frame_size)
+    threading.Thread(target=server.run, daemon=True).start()
+    port = server.server_socket._socket.getsockname()[1]
+    frames = queue.Queue()
+    client = DuplexClient(connect(port), PacketFactory.get_frame_size, lambda data: frames.put(bytes(data)), timeout=5)
+    try:
+        packet = PacketFactory.new_message_packet('Hello', SOURCE)
+        assert client.send(packet.get_buf()) == b'ACK'
+        reply = PacketFactory.new_message_packet('Hello back', ('127.0.0.1', 5001)).get_buf()
+        ReplyClient(lambda: connections[packet.get_source_server_address()]).send(reply)
+        assert frames.get(timeout=5) == reply
+    finally:
+        client.close()
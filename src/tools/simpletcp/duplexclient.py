@@ -0,0 +1,113 @@
+import socket
+import threading
+
+from src.tools.simpletcp.framing import FrameBuffer
+
+
+class DuplexClient:
+    def __init__(self, client, measure_frame, on_frame, ack=b"ACK", timeout=None, max_frame_size=None):
+        """
+
+        Wraps a persistent client (ClientSocket or AsyncClientSocket) whose server does not only answer with
+        ACKs, but may also send its own frames back on the same connection at any time.
+
+        A reader thread reads everything the server sends: every ack token is kept for send/receive, and every
+        frame (measured with measure_frame, see framing.FrameBuffer) is passed to on_frame(frame).
+        The sending API is the same as the wrapped client's.
+
+        timeout (seconds) bounds waiting for an ACK; socket.timeout is raised when it expires.
+        If the server announces a frame bigger than max_frame_size, the connection is treated as closed.
+        """
+        self.client = client
+        self.ack = ack
+        self.on_frame = on_frame
+        self.timeout = timeout
+        self.closed = False
+        # Number of ACKs received and not taken by send/receive yet.
+        self._acks = 0
+        self._condition = threading.Condition()
+        self._frame_buffer = FrameBuffer(self._measure(measure_frame), max_frame_size=max_frame_size)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _measure(self, measure_frame):
+        ack = self.ack
+
+        def measure(view):
+            if view[:len(ack)] == ack:
+                return len(ack)
+            return measure_frame(view)
+
+        return measure
+
+    def _read(self):
+        while not self.closed:
+            try:
+                data = self.client.receive()
+            except socket.timeout:
+                # Nothing to read for a while; that's fine.
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                break
+            try:
+                self._frame_buffer.feed(data)
+                for frame in self._frame_buffer.frames():
+                    if frame == self.ack:
+                        with self._condition:
+                            self._acks += 1
+                            self._condition.notify_all()
+                    else:
+                        self.on_frame(frame)
+            except ValueError:
+                # The server announced a frame we are not willing to buffer.
+                break
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _take_acks(self, at_most):
+        """
+        Wait for at least one ACK and take up to at_most of them.
+
+        Returns the ACK tokens taken, or b"" if the connection is closed.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._acks or self.closed, self.timeout):
+                raise socket.timeout("No ACK in {} seconds".format(self.timeout))
+            if not self._acks:
+                return b""
+            taken = min(self._acks, at_most) if at_most else self._acks
+            self._acks -= taken
+            return self.ack * taken
+
+    def get_port(self):
+        return self.client.get_port()
+
+    def get_ip(self):
+        return self.client.get_ip()
+
+    def send(self, data):
+        """
+
+        Send data and wait for its ACK, like ClientSocket.send; b"" means the connection was closed.
+        """
+        self.client.sendall(data)
+        return self._take_acks(1)
+
+    def sendall(self, data):
+        self.client.sendall(data)
+
+    def send_buffers(self, buffers):
+        self.client.send_buffers(buffers)
+
+    def receive(self):
+        """
+
+        Wait for ACKs, like ClientSocket.receive; Frames never show up here, they go to on_frame.
+        """
+        return self._take_acks(None)
+
+    def close(self):
+        self.closed = True
+        self.client.close()
@@ -0,0 +1,89 @@
+from typing import Callable, Iterator, Optional
+
+
+class FrameBuffer:
+    """
+     Reassembles length-prefixed frames out of a byte stream.
+
+     measure specifies how frames are delimited:
+     measure(view) is called with the unread bytes of the stream and must return the total size of the frame
+     that starts at view[0], or None if view does not contain enough of the header to know it yet.
+
+     Data is received straight into a preallocated bytearray with recv_into, and complete frames are handed out as
+     memoryview slices of it, so no bytes object is made per recv or per frame.
+     A region that has been handed out is never written again; when the buffer runs out of room a new one is
+     allocated and only the partial frame at its tail is copied, so frames stay valid for as long as they are used.
+    """
+
+    def __init__(self, measure: Callable[[memoryview], Optional[int]], capacity: int = 16384,
+                 min_free: int = 2048, max_frame_size: Optional[int] = None):
+        self.measure = measure
+        self.capacity = capacity
+        self.min_free = min_free
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(capacity)
+        self._start = 0
+        self._end = 0
+        # Whether any frame has been handed out of the current buffer.
+        self._exported = False
+
+    def recv_into(self, sock) -> int:
+        """
+        Receive from sock directly into the buffer.
+
+        :return: Number of bytes received; 0 means the connection was closed.
+        """
+        self._reserve(self.min_free)
+        with memoryview(self._buffer) as view:
+            received = sock.recv_into(view[self._end:])
+        self._end += received
+        return received
+
+    def feed(self, data) -> None:
+        """
+        Append data that has already been read from the stream (e.g. by an asyncio StreamReader).
+        """
+        self._reserve(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def frames(self) -> Iterator[memoryview]:
+        """
+        Yield every complete frame that is in the buffer.
+        """
+        view = memoryview(self._buffer)
+        while True:
+            size = self.__pending_frame_size(view)
+            if size is None or self._end - self._start < size:
+                return
+            frame = view[self._start:self._start + size]
+            self._start += size
+            self._exported = True
+            yield frame
+
+    def __pending_frame_size(self, view: memoryview) -> Optional[int]:
+        size = self.measure(view[self._start:self._end])
+        if size is not None and self.max_frame_size is not None and size > self.max_frame_size:
+            raise ValueError(f'Frame of {size} bytes is bigger than {self.max_frame_size} bytes.')
+        return size
+
+    def _reserve(self, free: int) -> None:
+        """
+        Make sure there are at least 'free' bytes after the data and room for the whole pending frame.
+        """
+        pending = self._end - self._start
+        if pending == 0 and not self._exported:
+            self._start = self._end = 0
+        with memoryview(self._buffer) as view:
+            frame_size = self.__pending_frame_size(view) or 0
+        if len(self._buffer) - self._end >= free and len(self._buffer) - self._start >= frame_size:
+            return
+        size = max(self.capacity, pending + free, frame_size)
+        if self._exported or size > len(self._buffer):
+            buffer = bytearray(size)
+            buffer[:pending] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+            self._exported = False
+        else:
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+        self._start, self._end = 0, pending
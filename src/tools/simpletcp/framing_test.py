@@ -0,0 +1,60 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from src.Packet import FRAGMENT_SIZE, HEADER_STRUCT, MAX_FRAME_SIZE, PacketFactory
+from src.tools.simpletcp.framing import FrameBuffer
+from src.tools.simpletcp.tcpserver import TCPServer
+
+# A Message header that announces a body of almost 2 GB.
+OVERSIZED_HEADER = HEADER_STRUCT.pack(1, 4, 0x7fffffff, 127, 0, 0, 1, 5000)
+
+
+def test_oversized_frame_is_refused_before_buffering():
+    frame_buffer = FrameBuffer(PacketFactory.get_frame_size, max_frame_size=MAX_FRAME_SIZE)
+    with pytest.raises(ValueError):
+        frame_buffer.feed(OVERSIZED_HEADER)
+        list(frame_buffer.frames())
+    assert len(frame_buffer._buffer) == frame_buffer.capacity
+
+
+def connect(port: int) -> socket.socket:
+    # The server starts listening on its own thread.
+    deadline = time.time() + 5
+    while True:
+        try:
+            return socket.create_connection(('127.0.0.1', port), timeout=5)
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+@pytest.mark.parametrize('backend', ['select', 'selectors'])
+def test_server_closes_connection_on_oversized_frame(backend):
+    frames = []
+    server = TCPServer('127.0.0.1', 0, lambda ip, queue, data: frames.append(data),
+                       measure_frame=PacketFactory.get_frame_size, backend=backend, max_frame_size=MAX_FRAME_SIZE)
+    threading.Thread(target=server.run, daemon=True).start()
+    port = server.server_socket._socket.getsockname()[1]
+    client = connect(port)
+    try:
+        client.sendall(OVERSIZED_HEADER)
+        try:
+            assert client.recv(1) == b''
+        except ConnectionResetError:
+            pass
+    finally:
+        client.close()
+    assert frames == []
+
+
+def test_frames_up_to_the_limit_are_delivered():
+    frame_buffer = FrameBuffer(PacketFactory.get_frame_size, max_frame_size=MAX_FRAME_SIZE)
+    # The biggest frame a sender makes: A whole fragment.
+    packet = PacketFactory.new_message_packets(b'x' * (2 * FRAGMENT_SIZE), ('127.0.0.1', 5000))[0]
+    assert len(packet.get_buf()) == MAX_FRAME_SIZE
+    frame_buffer.feed(packet.get_buf())
+    assert [bytes(frame) for frame in frame_buffer.frames()] == [packet.get_buf()]
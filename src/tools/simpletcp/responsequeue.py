@@ -0,0 +1,66 @@
+import queue
+
+
+class ResponseQueue(queue.Queue):
+    """
+     The queue that a server passes to read_callback for every connection.
+     Anything put in it is written to that connection, even when it is put later from another thread:
+     notify is called after every put so the server can wake up and write it.
+     closed becomes True once the connection is gone; nothing put after that is sent.
+    """
+
+    def __init__(self, notify=None):
+        queue.Queue.__init__(self)
+        self.notify = notify
+        self.closed = False
+
+    def put(self, item, block=True, timeout=None):
+        queue.Queue.put(self, item, block, timeout)
+        if self.notify is not None:
+            self.notify()
+
+
+class ReplyClient:
+    def __init__(self, get_queue, ack=b"ACK"):
+        """
+
+        The persistent client API (send, sendall, send_buffers, receive, close) on top of a connection that the
+        other side opened to our server: data is put in the ResponseQueue of that connection instead of being
+        sent on a connection of our own.
+
+        get_queue() returns the current ResponseQueue of the connection; it changes when the other side reconnects.
+        Delivery is left to TCP, so everything is ACKed as soon as it is queued.
+        """
+        self.get_queue = get_queue
+        self.ack = ack
+        self.closed = False
+        # Number of buffers queued by sendall/send_buffers and not reported by receive yet.
+        self._unacked = 0
+
+    def _put(self, data):
+        responses = self.get_queue()
+        if self.closed or responses is None or responses.closed:
+            raise ConnectionError("The connection to the server was closed")
+        responses.put(bytes(data))
+
+    def send(self, data):
+        if type(data) == str:
+            data = bytes(data, "UTF-8")
+        self._put(data)
+        return self.ack
+
+    def sendall(self, data):
+        self._put(data)
+        self._unacked += 1
+
+    def send_buffers(self, buffers):
+        # One put, so the server writes them together.
+        self._put(b"".join(buffers))
+        self._unacked += len(buffers)
+
+    def receive(self):
+        acks, self._unacked = self.ack * self._unacked, 0
+        return acks
+
+    def close(self):
+        self.closed = True
@@ -1,13 +1,32 @@
 import errno
 import queue
 import select
+import selectors
 import socket
 import sys
+import threading
+
+from src.tools.simpletcp.framing import FrameBuffer
+from src.tools.simpletcp.responsequeue import ResponseQueue
+from src.tools.simpletcp.vectored import send_some
+
+
+class _Connection:
+    """
+    Everything the selectors backend keeps for one client socket; stored as its SelectorKey data.
+    """
+
+    def __init__(self, ip, responses, frame_buffer):
+        self.ip = ip
+        self.queue = responses
+        self.frame_buffer = frame_buffer
+        self.unsent = []
 
 
 class ServerSocket:
 
-    def __init__(self, mode, port, read_callback, max_connections, received_bytes):
+    def __init__(self, mode, port, read_callback, max_connections, received_bytes, measure_frame=None,
+                 backend="select", max_frame_size=None):
         """
         Handle the socket's mode.
         The socket's mode determines the IP address it binds to.
@@ -15,6 +34,17 @@ class ServerSocket:
         localhost -> (127.0.0.1)
         public ->    (0.0.0.0)
         otherwise, mode is interpreted as an IP address.
+
+        If measure_frame is given, the byte stream of every connection is split into frames with a FrameBuffer
+        (see framing.py) and the callback is called once per complete frame instead of once per recv.
+        A connection that announces a frame bigger than max_frame_size is closed before anything is buffered for it.
+
+        backend chooses the event loop:
+        select ->    select.select over lists of sockets (limited to 1024 file descriptors)
+        selectors -> selectors.DefaultSelector (epoll on Linux, kqueue on BSD) with O(1) registration
+
+        The queue passed to the callback is a ResponseQueue: data put in it from any thread, at any time,
+        is written to the connection.
         """
 
         if mode == "localhost":
@@ -45,13 +75,158 @@ class ServerSocket:
         # Save the number of bytes to be received each time we read from
         # a socket
         self.received_bytes = received_bytes
+        self.measure_frame = measure_frame
+        self.max_frame_size = max_frame_size
+        if backend not in ("select", "selectors"):
+            print("backend must be 'select' or 'selectors'", file=sys.stderr)
+            raise ValueError
+        self.backend = backend
+        # A socket pair to wake the loop up when a response is queued from another thread.
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(0)
+        self._wake_writer.setblocking(0)
+        # Client sockets that got responses from other threads since the last wake up.
+        self._woken = set()
+        self._woken_lock = threading.Lock()
+        self._loop_thread = None
+
+    def _new_queue(self, sock):
+        return ResponseQueue(lambda: self._wake(sock))
+
+    def _wake(self, sock):
+        if threading.get_ident() == self._loop_thread:
+            # Responses put by the callback are written after it returns anyway.
+            return
+        with self._woken_lock:
+            self._woken.add(sock)
+        try:
+            self._wake_writer.send(b"\0")
+        except BlockingIOError:
+            # The loop has plenty of wake ups to read already.
+            pass
+
+    def _take_woken(self):
+        try:
+            while self._wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._woken_lock:
+            woken, self._woken = self._woken, set()
+        return woken
+
+    def _new_frame_buffer(self):
+        if self.measure_frame is None:
+            return None
+        return FrameBuffer(self.measure_frame, max_frame_size=self.max_frame_size)
+
+    def _receive(self, sock, frame_buffer):
+        """
+        Read from sock.
+
+        :return: The list of data to pass to the callback, or None if the connection was closed.
+        """
+        try:
+            if frame_buffer is None:
+                data = sock.recv(self.received_bytes)
+                return [data] if data else None
+            if not frame_buffer.recv_into(sock):
+                return None
+            return list(frame_buffer.frames())
+        except socket.error as e:
+            if e.errno == errno.ECONNRESET:
+                # Consider 'Connection reset by peer'
+                # the same as reading zero bytes
+                return None
+            raise e
+        except ValueError:
+            # The peer announced a frame we are not willing to buffer.
+            return None
+
+    @staticmethod
+    def _flush(sock, responses, unsent):
+        """
+        Send everything that is queued for sock in one scatter-gather write,
+        so responses to pipelined requests are batched together.
+        unsent is the list of memoryviews the socket did not take last time; it is sent first,
+        and whatever the socket does not take now is left in it.
+
+        :return: False if there was nothing to send.
+        """
+        while True:
+            try:
+                unsent.append(memoryview(responses.get_nowait()))
+            except queue.Empty:
+                break
+        if not unsent:
+            return False
+        try:
+            send_some(sock, unsent)
+        except BlockingIOError:
+            pass
+        return True
 
     def run(self):
         # Start listening
         self._socket.listen(self._max_connections)
+        self._loop_thread = threading.get_ident()
+        if self.backend == "selectors":
+            self._run_selectors()
+        else:
+            self._run_select()
+
+    def _run_selectors(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._socket, selectors.EVENT_READ)
+        selector.register(self._wake_reader, selectors.EVENT_READ)
+        while True:
+            for key, events in selector.select():
+                sock = key.fileobj
+                if sock is self._socket:
+                    # We have a viable connection!
+                    client_socket, client_ip = self._socket.accept()
+                    client_socket.setblocking(0)
+                    selector.register(client_socket, selectors.EVENT_READ,
+                                      _Connection(client_ip, self._new_queue(client_socket),
+                                                  self._new_frame_buffer()))
+                    continue
+                if sock is self._wake_reader:
+                    # Responses were queued from other threads.
+                    for woken in self._take_woken():
+                        try:
+                            woken_key = selector.get_key(woken)
+                        except (KeyError, ValueError):
+                            # Closed meanwhile.
+                            continue
+                        if not woken_key.events & selectors.EVENT_WRITE:
+                            selector.modify(woken, selectors.EVENT_READ | selectors.EVENT_WRITE, woken_key.data)
+                    continue
+                connection = key.data
+                try:
+                    if events & selectors.EVENT_READ:
+                        chunks = self._receive(sock, connection.frame_buffer)
+                        if chunks is None:
+                            connection.queue.closed = True
+                            selector.unregister(sock)
+                            sock.close()
+                            continue
+                        for data in chunks:
+                            self.callback(connection.ip, connection.queue, data)
+                        # Watch for writability until the responses are out.
+                        if not key.events & selectors.EVENT_WRITE:
+                            selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+                    if events & selectors.EVENT_WRITE:
+                        if not self._flush(sock, connection.queue, connection.unsent):
+                            selector.modify(sock, selectors.EVENT_READ, connection)
+                except OSError:
+                    connection.queue.closed = True
+                    selector.unregister(sock)
+                    sock.close()
+
+    def _run_select(self):
         # Create a list of readers (sockets that will be read from) and a list
         # of writers (sockets that will be written to).
-        readers = [self._socket]
+        readers = [self._socket, self._wake_reader]
         writers = []
         # Create a dictionary of queue.Queues for data to be sent.
         # This dictionary maps sockets to queue.Queue objects
@@ -59,6 +234,10 @@ class ServerSocket:
         # Create a similar dictionary that stores IP addresses.
         # This dictionary maps sockets to IP addresses
         IPs = dict()
+        # And one that maps sockets to their FrameBuffers (None if we are not framing).
+        frame_buffers = dict()
+        # And one for the data that a socket did not take in its last write.
+        unsent = dict()
         # Now, the main loop.
         while readers:
             # Block until a socket is ready for processing.
@@ -73,23 +252,23 @@ class ServerSocket:
                     # Add it to our readers.
                     readers.append(client_socket)
                     # Make a queue for it.
-                    queues[client_socket] = queue.Queue()
+                    queues[client_socket] = self._new_queue(client_socket)
                     # Store its IP address.
                     IPs[client_socket] = client_ip
+                    frame_buffers[client_socket] = self._new_frame_buffer()
+                    unsent[client_socket] = []
+                elif sock == self._wake_reader:
+                    # Responses were queued from other threads.
+                    for woken in self._take_woken():
+                        if woken in queues and woken not in writers:
+                            writers.append(woken)
                 else:
                     # Someone sent us something! Let's receive it.
-                    try:
-                        data = sock.recv(self.received_bytes)
-                    except socket.error as e:
-                        if e.errno == errno.ECONNRESET:
-                            # Consider 'Connection reset by peer'
-                            # the same as reading zero bytes
-                            data = None
-                        else:
-                            raise e
-                    if data:
+                    chunks = self._receive(sock, frame_buffers[sock])
+                    if chunks is not None:
                         # Call the callback
-                        self.callback(IPs[sock], queues[sock], data)
+                        for data in chunks:
+                            self.callback(IPs[sock], queues[sock], data)
                         # Put the client socket in writers so we can write to it
                         # later.
                         if sock not in writers:
@@ -104,22 +283,23 @@ class ServerSocket:
                         # Close the connection.
                         sock.close()
                         # Destroy is queue
+                        queues[sock].closed = True
                         del queues[sock]
+                        del frame_buffers[sock]
+                        del unsent[sock]
             # Deal with sockets that need to be written to.
             for sock in write:
-                try:
-                    # Get the next chunk of data in the queue, but don't wait.
-
-                    data = queues[sock].get_nowait()
-                except queue.Empty:
+                if sock not in queues:
+                    # Closed while it was read above.
+                    continue
+                # Send whatever is in the queue, but don't wait.
+                if not self._flush(sock, queues[sock], unsent[sock]):
                     # The queue is empty -> nothing needs to be written.
                     writers.remove(sock)
-                else:
-                    # The queue wasn't empty; we did, in fact, get something.
-                    # So send it.
-                    sock.send(data)
             # Deal with errors in sockets.
             for sock in err:
+                if sock not in queues:
+                    continue
                 # Remove the socket from every list.
                 readers.remove(sock)
                 if sock in writers:
@@ -127,4 +307,7 @@ class ServerSocket:
                 # Close the connection.
                 sock.close()
                 # Destroy its queue.
+                queues[sock].closed = True
                 del queues[sock]
+                del frame_buffers[sock]
+                del unsent[sock]
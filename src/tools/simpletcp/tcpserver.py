@@ -17,12 +17,17 @@ class TCPServer:
      is a tunnel of data to send to the socket that it received from.
      The third argument must be data, which is a string of bytes
      that the server received.
+     measure_frame is optional; if it is given, data is one complete frame as a memoryview
+     (see ServerSocket and framing.FrameBuffer) instead of whatever a single recv returned.
+     backend is either "select" or "selectors" (epoll on Linux); see ServerSocket.
+     max_frame_size limits the frames; A connection that announces a bigger one is closed.
     """
 
     def __init__(self, mode, port, read_callback,
-                 maximum_connections=5, receive_bytes=2048):
+                 maximum_connections=5, receive_bytes=2048, measure_frame=None, backend="select",
+                 max_frame_size=None):
         self.server_socket = ServerSocket(
-            mode, port, read_callback, maximum_connections, receive_bytes
+            mode, port, read_callback, maximum_connections, receive_bytes, measure_frame, backend, max_frame_size
         )
 
     def run(self):
@@ -0,0 +1,44 @@
+import socket
+
+# Most systems accept at most this many buffers in one sendmsg call.
+IOV_MAX = 1024
+
+
+def _advance(views, sent):
+    """
+    Drop 'sent' bytes from the front of the list of memoryviews.
+    """
+    done = 0
+    while done < len(views) and sent >= len(views[done]):
+        sent -= len(views[done])
+        done += 1
+    del views[:done]
+    if sent:
+        views[0] = views[0][sent:]
+
+
+def send_some(sock, views):
+    """
+    Write as much of views (a list of memoryviews) as the socket takes in one system call.
+    What was written is removed from views, so the rest can be sent later; this is how partial writes are resumed.
+
+    Returns the number of bytes written.
+    """
+    if hasattr(sock, "sendmsg"):
+        sent = sock.sendmsg(views[:IOV_MAX])
+    else:
+        # No scatter-gather on this platform.
+        sent = sock.send(b"".join(views[:IOV_MAX]))
+    _advance(views, sent)
+    return sent
+
+
+def send_all(sock, buffers):
+    """
+    Write every buffer (bytes-like) of buffers to a blocking socket, coalesced into as few system calls as
+    possible and without joining them into one copy first.
+    """
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        if send_some(sock, views) == 0:
+            raise socket.error("Socket connection broken")